@@ -0,0 +1,199 @@
+###
+# benchmark.py
+#
+# Description: Benchmark the bot's commands against fakeNotion without
+#              Discord or the real Notion API. Reports throughput, p50/p99
+#              latency and Notion API calls for each command, so
+#              regressions show up before deploying.
+#
+# Usage: python benchmark.py [--pages 1000] [--runs 200] [--latency 0.05]
+#                            [--rate-limit-chance 0.01] [--concurrency 1]
+###
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import fakeNotion
+
+#############
+# CONSTANTS #
+#############
+
+PORT = int(os.getenv("BENCHMARK_PORT", "8002"))
+
+# point the bot at the fake server before its modules are imported
+os.environ["NOTION_URL"] = "http://localhost:{0}/v1".format(PORT)
+os.environ["NOTION_API_KEY"] = "benchmark"
+os.environ["DATABASE_ID"] = fakeNotion.DATABASE_ID
+os.environ["TASK_STORE_PATH"] = os.path.join(tempfile.mkdtemp(), "tasks.db")
+# the fake server does not limit requests unless --rate-limit-chance is set
+os.environ.setdefault("NOTION_RATE_LIMIT", "1000")
+os.environ.setdefault("NOTION_RATE_BURST", "100")
+
+import bot as botCommands
+import botHelper
+import notionCache
+import notionDB
+import taskStore
+
+
+# Description: Stands in for the Discord command context. Messages sent by
+# 			   a command are kept instead of being posted
+class FakeContext:
+
+    def __init__(self, author="Alice"):
+        self.author = FakeAuthor(author)
+        self.sent = []
+
+    async def send(self, content=None, embed=None, view=None):
+        self.sent.append(embed if embed is not None else content)
+
+    # Description: Check if the command answered with an error message
+    def failed(self):
+        return any(
+            getattr(message, "colour", None) is not None
+            and message.colour.value == botHelper.RED
+            for message in self.sent)
+
+
+class FakeAuthor:
+
+    def __init__(self, name):
+        self.name = name
+        self.display_name = name
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Get a percentile of a list of latencies
+def percentile(latencies, percent):
+    latencies = sorted(latencies)
+    return latencies[round(percent / 100 * (len(latencies) - 1))]
+
+
+# Description: Arguments for each run of every benchmarked command
+# @return: list of (name, command, list of arguments)
+def workloads(pages, runs):
+    tags = fakeNotion.ASSIGNED_TO_TAGS
+    return [
+        ("newTask", botCommands.newTask, [
+            "bench task {0}//benchmark task//01 jan 30 1200//{1}//Bob//"
+            "Meeting".format(i, tags[i % len(tags)]) for i in range(runs)
+        ]),
+        ("getTask", botCommands.getTask,
+         ["task {0}".format(i % pages) for i in range(runs)]),
+        ("updateTask", botCommands.updateTask, [
+            "task {0}//description//updated {1}".format(i % pages, i)
+            for i in range(runs)
+        ]),
+        ("listTasks", botCommands.listTasks,
+         [tags[i % len(tags)] for i in range(runs)]),
+        ("findTasks",
+         lambda ctx, data: botCommands.findTasks(ctx, data=data), [
+             "to: {0} // done: no // after: 01 jan 30 0000 // before: "
+             "28 feb 30 0000".format(tags[i % len(tags)]) for i in range(runs)
+         ]),
+    ]
+
+
+# Description: Run a command once for every argument
+# @param concurrency: number of commands running at the same time
+# @return: dictionary of results
+async def benchmark(fake, command, arguments, concurrency):
+    latencies = []
+    errors = 0
+    limit = asyncio.Semaphore(concurrency)
+
+    async def invoke(argument):
+        nonlocal errors
+        async with limit:
+            ctx = FakeContext()
+            start = time.perf_counter()
+            try:
+                await command(ctx, argument)
+            except Exception:
+                errors += 1
+            else:
+                errors += ctx.failed()
+            latencies.append(time.perf_counter() - start)
+
+    calls = fake.totalCalls()
+    start = time.perf_counter()
+    await asyncio.gather(*(invoke(argument) for argument in arguments))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "throughput": len(arguments) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "calls": (fake.totalCalls() - calls) / len(arguments),
+        "errors": errors
+    }
+
+
+async def main(args):
+    fake = fakeNotion.FakeNotion(args.pages, args.latency,
+                                 args.rate_limit_chance)
+    await fake.start(PORT)
+    # keep the bot's status prints out of the report
+    if args.verbose:
+        output = contextlib.nullcontext()
+    else:
+        output = contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            start = time.perf_counter()
+            await notionCache.snapshot.sync()
+            syncTime = time.perf_counter() - start
+            syncCalls = fake.totalCalls()
+
+            results = []
+            for name, command, arguments in workloads(args.pages, args.runs):
+                results.append((name, await benchmark(fake, command,
+                                                      arguments,
+                                                      args.concurrency)))
+    finally:
+        await notionDB.closeSession()
+        await fake.stop()
+        taskStore.close()
+
+    print("{0} pages, {1} runs per command, {2:.0f}ms latency, "
+          "{3:.0%} 429s, concurrency {4}".format(args.pages, args.runs,
+                                                 args.latency * 1000,
+                                                 args.rate_limit_chance,
+                                                 args.concurrency))
+    print("initial sync: {0:.2f}s, {1} API calls\n".format(
+        syncTime, syncCalls))
+    print("{0:<12}{1:>12}{2:>10}{3:>10}{4:>12}{5:>8}".format(
+        "command", "commands/s", "p50 ms", "p99 ms", "calls/cmd", "errors"))
+    for name, result in results:
+        print("{0:<12}{1:>12.1f}{2:>10.2f}{3:>10.2f}{4:>12.2f}{5:>8}".format(
+            name, result["throughput"], result["p50"], result["p99"],
+            result["calls"], result["errors"]))
+    print("\n429s injected:", fake.rateLimited)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bot's commands against fakeNotion")
+    parser.add_argument("--pages", type=int, default=1000,
+                        help="pages in the fake database (10 to 50000)")
+    parser.add_argument("--runs", type=int, default=200,
+                        help="times each command is run")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds added to every Notion request")
+    parser.add_argument("--rate-limit-chance", type=float, default=0,
+                        help="chance of a Notion request getting a 429")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="commands running at the same time")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the bot's output")
+    asyncio.run(main(parser.parse_args()))
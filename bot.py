@@ -8,14 +8,22 @@
 
 import discord
 from discord.ext import commands
+import asyncio
 import os
+import time
 import datetime as dt
 from datetime import timedelta
-import json
 
+import botMetrics
 import notionDB
+import notionCache
+import notionRefresh
+import notionEvents
+import taskStore
 import botHelper
-from keepAlive import keep_alive
+import keepAlive
+import reminders
+import slashCommands
 
 #############
 # CONSTANTS #
@@ -46,14 +54,67 @@ YELLOW = 0xFFFF00
 # GLOBAL VARIABLES #
 ####################
 
+# process start, used to measure the time until the first command is served
+startTime = time.monotonic()
+# seconds from startTime until the first command was served
+firstCommandTime = None
+
 # Define the bot
+class TaskBot(commands.Bot):
+
+    # Description: Load the snapshot saved by the last run, start the
+    # 			   background refresh, webhook events, keep alive server and
+    # 			   reminders and register the slash commands before
+    # 			   connecting
+    async def setup_hook(self):
+        count = await notionCache.snapshot.load()
+        print("Loaded {0} tasks from the task store in {1:.2f}s".format(
+            count,
+            time.monotonic() - startTime))
+        notionRefresh.start()
+        notionEvents.start()
+        await keepAlive.start(self)
+        await reminders.start(self)
+        await slashCommands.setup(self)
+
+    # Description: Stop the reminders and the keep alive server and close
+    # 			   the Notion connections and the task store when the bot
+    # 			   shuts down
+    async def close(self):
+        reminders.stop()
+        await keepAlive.stop()
+        await super().close()
+        await notionDB.closeSession()
+        taskStore.close()
+
+
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="$", intents=intents)
+# reminders look up assignees by their display name to mention or DM them
+intents.members = reminders.enabled()
+bot = TaskBot(command_prefix="$", intents=intents)
+# time every command for the /metrics endpoint
+bot.before_invoke(botMetrics.beforeCommand)
+bot.after_invoke(botMetrics.afterCommand)
+
+# seconds a task stays marked for deletion before it must be marked again
+PENDING_DELETE_TTL = float(os.getenv("PENDING_DELETE_TTL", "86400"))
+
+# field names by field code, used in update summaries
+fieldNames = {
+    1: "Task",
+    2: "Description",
+    3: "Date",
+    4: "Assigned To",
+    5: "Assigned By",
+    6: "Type",
+    7: "Completion"
+}
 
-# tasks that are pending for deletion from Notion
-deleteList = []
+# $findTasks tag filters -> tag list they search
+# [{0: assignTo}, {1: assignBy}, {2: taskType}]
+tagFilters = {"to": 0, "by": 1, "type": 2}
 
 #list of all tag names
 assignToNames = []
@@ -106,21 +167,38 @@ def validDateTime(date_txt):
     return noError
 
 
-# Description: Check if the taskName exists within pages.json
+# Description: Convert a date and time given by a user into a datetime
+# @param date_txt: The date and time as a string with format [01 Jan 22 1300]
+# @return: the datetime, or None if date_txt is not in that format
+def parseDateTime(date_txt):
+    list = date_txt.split(" ")
+    if len(list) != 4 or list[1].lower() not in months:
+        return None
+    try:
+        return dt.datetime(int("20" + list[2]), months[list[1].lower()],
+                           int(list[0]), int(list[3][:2]),
+                           int(list[3][-2:]))
+    except ValueError:
+        return None
+
+
+# Description: Error message for a task name that does not exist, with
+# 			   the names it may have been mistyped from
+# @param taskName: Name of a task that does not exist
+def missingTaskMessage(taskName):
+    suggestions = notionCache.snapshot.suggestNames(taskName)
+    if len(suggestions) == 0:
+        return "Task name does not exist"
+    return ("Task name does not exist. Did you mean: " +
+            ", ".join("**" + name + "**" for name in suggestions) + "?")
+
+
+# Description: Check if the taskName exists within the cached pages
 # @param taskName: Name of a task
 # @return: If taskName exists, return true, false otherwise
-def taskNameExists(taskName):
-    notionDB.readDatabase()
-    ret = False
-    with open("./pages.json") as f:
-        pages = json.load(f)
-
-    for page in pages:
-        if (page["properties"]["Task"]["title"][0]["text"]["content"].lower()
-                == taskName.lower()):
-            ret = True
-
-    return ret
+async def taskNameExists(taskName):
+    task = await notionCache.snapshot.findTask(taskName)
+    return task is not None
 
 
 # Description Check if a given list of tags exists for that heading
@@ -135,49 +213,131 @@ def taskNameExists(taskName):
 # 		   If the tags list is empty from Notion, (index 0) == -1, and
 #		   (index 1) == error message
 # Pre-condition: listNum is within {0,1,2}
-def listValidation(str_list, listNum):
-    botHelper.listTagNames(tagNames)
-    ret = [0]  # return list with a valid bit
-    list = tagNames[listNum]
+async def listValidation(str_list, listNum):
+    await notionCache.snapshot.getTagIndex(listNum)
+    return tagValidation(str_list, listNum)
+
+
+# Description: listValidation against the snapshot as it is, without
+# 			   syncing
+def tagValidation(str_list, listNum):
+    tagIndex = notionCache.snapshot.tagIndex[listNum]
 
     # no tags from notion
-    if len(list) == 0:
-        ret[0] = -1
-        ret.append("No valid tags")
-    else:
-        # isolate tags from str_list
-        nameList = str_list.split(",")
-        nameList = [name.strip() for name in nameList]
-        nameList_lowered = [item.lower() for item in nameList]
-
-        # check if tag is in the list
-        for i in range(0, len(nameList_lowered)):
-            inserted = False
-            j = 0
-            while j < len(list) and not inserted:
-                # append to ret if name matches and valid bit
-                if (nameList_lowered[i] == list[j].lower() and ret[0] == 0):
-                    ret.append(list[j])
-                    inserted = True
-# mark the string as a match so it is not added to invalid ret
-                elif (nameList_lowered[i] == list[j].lower() and ret[1] == 0):
-                    inserted = True
-                j += 1
-
-# if ret is so far valid, but the current name
-# is not in list, reset ret, give an invalid bit
-# and append the invalid name
-            if ret[0] == 0 and not inserted:
-                ret = []
-                ret.append(1)
-                ret.append(nameList[i])
-
-# if ret is the list of invalid names and the
-#current name is invalid, add it invalid list
-            elif ret[0] == 1 and not inserted:
-                ret.append(nameList[i])
-
-    return ret
+    if len(tagIndex) == 0:
+        return [-1, "No valid tags"]
+
+    # isolate tags from str_list
+    nameList = str_list.split(",")
+    nameList = [name.strip() for name in nameList]
+
+    # look up the canonical name of each tag
+    valid = [0]
+    invalid = [1]
+    for name in nameList:
+        tag = tagIndex.get(name.casefold())
+        if tag is None:
+            invalid.append(name)
+        else:
+            valid.append(tag)
+
+    return invalid if len(invalid) > 1 else valid
+
+
+# Description: Determine the field code of a field name and validate the
+# 			   new information for that field
+# @param field: lowercase field name given by the user
+# @param info: new information for the field
+# @return: [fieldCode, info, msg]. field is enumerated such that:
+#	{1: Task}, {2: Description}, {3: Date},
+# 	{4: Assigned To}, {5: Assigned By},
+#	{6: Type}, {7: Completion}
+# 		   fieldCode == 0 if the field does not exist and fieldCode == -1
+# 		   if the information is invalid, with msg explaining why.
+# 		   Otherwise info is converted to the format Notion expects
+# Pre-condition: the snapshot is synced, it is read as it is
+def fieldValidation(field, info):
+    fieldCode = 0
+    msg = ""
+    if "name" in field:
+        fieldCode = 1
+        # validate data
+        msg = info.lower() in notionCache.snapshot.nameIndex
+        if msg == True:
+            msg = "**" + info + "**" + " already exists for different task name"
+            fieldCode = -1
+
+    elif "desc" in field:
+        fieldCode = 2
+    elif "date" in field or "time" in field:
+        fieldCode = 3
+        msg = validDateTime(info)
+        if msg != " ":
+            fieldCode = -1
+        else:
+            # parse dateTime
+            info = dt.datetime.today().replace(int("20" + info[7:9]),
+                                               int(months[info[3:6]]),
+                                               int(info[0:2]),
+                                               hour=int(info[10:12]),
+                                               minute=int(info[13:15]),
+                                               microsecond=0).isoformat()
+    elif "to" in field:
+        fieldCode = 4
+        valid = tagValidation(info, 0)
+        if valid[0] == 1:
+            fieldCode = -1
+            list = ", ".join(valid[1:])
+            msg = "The following \"Assign To\" tags are incorrect: " + list
+        else:
+            info = []
+            list = valid[1:]
+            list = [tag.strip() for tag in list]
+            for tag in list:
+                info.append({"name": tag})
+
+    elif "by" in field:
+        fieldCode = 5
+        valid = tagValidation(info, 1)
+        if valid[0] == 1:
+            fieldCode = -1
+            list = ", ".join(valid[1:])
+            msg = "The following \"Assign By\" tags are incorrect: " + list
+        else:
+            info = []
+            list = valid[1:]
+            list = [tag.strip() for tag in list]
+            for tag in list:
+                info.append({"name": tag})
+    elif "type" in field:
+        fieldCode = 6
+        valid = tagValidation(info, 2)
+        if valid[0] == 1:
+            fieldCode = -1
+            list = ", ".join(valid[1:])
+            msg = "The following \"Task Type\" tags are incorrect: " + list
+        else:
+            info = []
+            list = valid[1:]
+            list = [tag.strip() for tag in list]
+            for tag in list:
+                info.append({"name": tag})
+    elif "comp" in field:
+        fieldCode = 7
+        true = ["complete", "done", "true", "finish", "yes"]
+        false = [
+            "not done", "not complete", "undone", "undue", "false",
+            "incomplete", "no"
+        ]
+        if info.lower() in true:
+            info = True
+        elif info.lower() in false:
+            info = False
+        else:
+            fieldCode = -1
+            msg = "Completion word is not recognized"
+
+    return [fieldCode, info, msg]
 
 
 ######################
@@ -185,11 +345,22 @@ def listValidation(str_list, listNum):
 ######################
 
 
-# Description: Wait for the bot to be ready and read the notion database
+# Description: Wait for the bot to be ready. The notion database is read
+# 			   by the background refresh loop
 @bot.event
 async def on_ready():
     print("Logged in as {0.user}".format(bot))
-    notionDB.readDatabase()
+    print("Ready {0:.2f}s after start".format(time.monotonic() - startTime))
+
+
+# Description: Record how long after start the first command was served
+@bot.event
+async def on_command_completion(ctx):
+    global firstCommandTime
+    if firstCommandTime is None:
+        firstCommandTime = time.monotonic() - startTime
+        print("First command served {0:.2f}s after start".format(
+            firstCommandTime))
 
 
 # Description: Capture a message sent by a user and do a action
@@ -223,11 +394,11 @@ async def newTask(ctx, data):
     taskType = dataSplit[5].strip()
 
     ### data validation ###
-    taskNameMsg = taskNameExists(taskName)
+    taskNameMsg = await taskNameExists(taskName)
     dtMsg = validDateTime(dateTime)
-    assignToValid = listValidation(assignedTo, 0) if assignedTo != "" else [0]
-    assignByValid = listValidation(assignedBy, 1) if assignedBy != "" else [0]
-    taskTypeValid = listValidation(taskType, 2) if taskType != "" else [0]
+    assignToValid = await listValidation(assignedTo, 0) if assignedTo != "" else [0]
+    assignByValid = await listValidation(assignedBy, 1) if assignedBy != "" else [0]
+    taskTypeValid = await listValidation(taskType, 2) if taskType != "" else [0]
 
     if taskNameMsg == True:
         await botHelper.errorMessage(
@@ -263,37 +434,19 @@ async def newTask(ctx, data):
                                                 hour=int(dateTime[10:12]),
                                                 minute=int(dateTime[13:15]),
                                                 microsecond=0).isoformat())
-        assignedTo = ", ".join(assignToValid[1:])
-        assignedBy = ", ".join(assignByValid[1:])
-        taskType = ", ".join(taskTypeValid[1:])
-        # parse assignTo tags
-        assignToList = []
-        list = assignedTo.split(",")
-        list = [tag.strip() for tag in list]
-        for tag in list:
-            assignToList.append({"name": tag})
-
-# parse assignBy tags
-        assignByList = []
-        list = assignedBy.split(",")
-        list = [tag.strip() for tag in list]
-        for tag in list:
-            assignByList.append({"name": tag})
-
-# parse taskType tags
-        taskTypeList = []
-        list = taskType.split(",")
-        list = [tag.strip() for tag in list]
-        for tag in list:
-            taskTypeList.append({"name": tag})
+        # validated tags, empty when none were given. Notion rejects
+        # a tag with an empty name
+        assignToList = [{"name": tag} for tag in assignToValid[1:]]
+        assignByList = [{"name": tag} for tag in assignByValid[1:]]
+        taskTypeList = [{"name": tag} for tag in taskTypeValid[1:]]
 
 # post new task
-        status = notionDB.createPage(taskName, desc, dateTime, assignToList,
-                                     assignByList, taskTypeList)
-        if status == 200:
-            notionDB.readDatabase()
+        task = await notionDB.createPage(taskName, desc, dateTime,
+                                         assignToList, assignByList,
+                                         taskTypeList)
+        if task is not None:
             title = "*" + taskName.capitalize() + "*" + " is posted to Notion"
-            await botHelper.displayTaskInfo_str(ctx, data, title)
+            await botHelper.displayTaskInfo_task(ctx, task, title)
         else:
             desc = (taskName.capitalize() + " could not be posted. " +
                     "Ask ask CI Tsang for help or report it to" +
@@ -305,9 +458,9 @@ async def newTask(ctx, data):
 # @param taskName: Unique name of the task
 @bot.command()
 async def getTask(ctx, taskName):
-    msg = taskNameExists(taskName)
+    msg = await taskNameExists(taskName)
     if msg == False:
-        await botHelper.errorMessage(ctx, "Task name does not exist")
+        await botHelper.errorMessage(ctx, missingTaskMessage(taskName))
     else:
         await botHelper.displayTaskInfo_name(ctx, taskName, "Task Request")
 
@@ -325,94 +478,11 @@ async def updateTask(ctx, data):
     info = dataSplit[2].strip()
 
     # validate that the task name exists
-    exists = taskNameExists(taskName)
+    exists = await taskNameExists(taskName)
     if exists == False:
-        await botHelper.errorMessage(ctx, "Task name does not exist")
+        await botHelper.errorMessage(ctx, missingTaskMessage(taskName))
     else:
-        # determine the field code and validate the data
-        # field is enumerated such that:
-        #	{1: Task}, {2: Description}, {3: Date},
-        # 	{4: Assigned To}, {5: Assigned By},
-        #	{6: Type}, {7: Completion}
-        fieldCode = 0
-        msg = ""
-        if "name" in field:
-            fieldCode = 1
-            # validate data
-            msg = taskNameExists(info)
-            if msg == True:
-                msg = "**" + info + "**" + " already exists for different task name"
-                fieldCode = -1
-
-        elif "desc" in field:
-            fieldCode = 2
-        elif "date" in field or "time" in field:
-            fieldCode = 3
-            msg = validDateTime(info)
-            if msg != " ":
-                fieldCode = -1
-            else:
-                # parse dateTime
-                info = dt.datetime.today().replace(int("20" + info[7:9]),
-                                                   int(months[info[3:6]]),
-                                                   int(info[0:2]),
-                                                   hour=int(info[10:12]),
-                                                   minute=int(info[13:15]),
-                                                   microsecond=0).isoformat()
-        elif "to" in field:
-            fieldCode = 4
-            valid = listValidation(info, 0)
-            if valid[0] == 1:
-                fieldCode = -1
-                list = ", ".join(valid[1:])
-                msg = "The following \"Assign To\" tags are incorrect: " + list
-            else:
-                info = []
-                list = valid[1:]
-                list = [tag.strip() for tag in list]
-                for tag in list:
-                    info.append({"name": tag})
-
-        elif "by" in field:
-            fieldCode = 5
-            valid = listValidation(info, 1)
-            if valid[0] == 1:
-                fieldCode = -1
-                list = ", ".join(valid[1:])
-                msg = "The following \"Assign By\" tags are incorrect: " + list
-            else:
-                info = []
-                list = valid[1:]
-                list = [tag.strip() for tag in list]
-                for tag in list:
-                    info.append({"name": tag})
-        elif "type" in field:
-            fieldCode = 6
-            valid = listValidation(info, 2)
-            if valid[0] == 1:
-                fieldCode = -1
-                list = ", ".join(valid[1:])
-                msg = "The following \"Task Type\" tags are incorrect: " + list
-            else:
-                info = []
-                list = valid[1:]
-                list = [tag.strip() for tag in list]
-                for tag in list:
-                    info.append({"name": tag})
-        elif "comp" in field:
-            fieldCode = 7
-            true = ["complete", "done", "true", "finish", "yes"]
-            false = [
-                "not done", "not complete", "undone", "undue", "false",
-                "incomplete", "no"
-            ]
-            if info.lower() in true:
-                info = True
-            elif info.lower() in false:
-                info = False
-            else:
-                fieldCode = -1
-                msg = "Completion word is not recognized"
+        fieldCode, info, msg = fieldValidation(field, info)
 
         if fieldCode == 0:
             desc = (
@@ -422,104 +492,224 @@ async def updateTask(ctx, data):
         elif fieldCode == -1:
             await botHelper.errorMessage(ctx, msg)
         else:
-            notionDB.updatePage(taskName, fieldCode, info)
-            notionDB.readDatabase()
-            await botHelper.displayTaskInfo_name(ctx, taskName,
-                                                 "Task Updated!")
+            task = await notionDB.updatePage(taskName, fieldCode, info)
+            if task is not None:
+                await botHelper.displayTaskInfo_task(ctx, task,
+                                                     "Task Updated!")
+            else:
+                desc = (taskName + " could not be updated. " +
+                        "Ask ask CI Tsang for help or report it to" +
+                        " the channel *bot-errors*")
+                await botHelper.errorMessage(ctx, desc)
 
 
+# Description: Update many tasks at once. Every line is validated against
+# 			   the same snapshot, changes to the same task are merged into a
+# 			   single request and the requests are sent concurrently
+# @param data: one update per line in the // format.
+# Pre-condition: data should follow the format -->
+# 	$bulkUpdateTask
+# 	taskName//field//info
+# 	taskName//field//info
 @bot.command()
-async def deleteTask(ctx, taskName):
-    msg = taskNameExists(taskName)
-    if msg == False:
-        await botHelper.errorMessage(ctx, "Task name does not exist")
+async def bulkUpdateTask(ctx, *, data):
+    results = []  # [taskName, outcome] for the summary
+    pending = {}  # page ID -> [taskName, properties, field names]
+    newNames = {}  # lowercase name given by an earlier line -> page ID
+
+    ### data validation ###
+    # every line is checked against the same snapshot
+    snapshot = notionCache.snapshot
+    await snapshot.ensureFresh()
+    for line in data.strip().strip("\"").splitlines():
+        if line.strip() == "":
+            continue
+
+        dataSplit = line.split("//")
+        if len(dataSplit) != 3:
+            results.append([line.strip(), "Line must be taskName//field//info"])
+            continue
+        taskName = dataSplit[0].strip()
+        field = dataSplit[1].strip().lower()
+        info = dataSplit[2].strip()
+
+        task = snapshot.nameIndex.get(taskName.lower())
+        if task is None:
+            results.append([taskName, missingTaskMessage(taskName)])
+            continue
+
+        fieldCode, info, msg = fieldValidation(field, info)
+        if fieldCode == 0:
+            results.append([taskName, "Field name does not exist"])
+            continue
+        elif fieldCode == -1:
+            results.append([taskName, msg])
+            continue
+        elif fieldCode == 1:
+            if newNames.get(info.lower(), task.id) != task.id:
+                results.append([
+                    taskName, "**" + info + "**" +
+                    " is given to another task in this update"
+                ])
+                continue
+            newNames[info.lower()] = task.id
+
+        # merge changes to the same task into one request
+        update = pending.setdefault(task.id, [task.name, {}, []])
+        update[1].update(notionDB.buildProperties(fieldCode, info))
+        update[2].append(fieldNames[fieldCode])
+
+    ### post updates ###
+    updates = list(pending.items())
+    # a failed request is reported with its task, the others still finish
+    tasks = await asyncio.gather(*[
+        notionDB.updatePageProperties(pageID, update[1])
+        for pageID, update in updates
+    ], return_exceptions=True)
+    for (pageID, update), task in zip(updates, tasks):
+        if isinstance(task, BaseException):
+            print("Bulk update failed for", update[0], repr(task))
+            results.append([update[0], "Could not be updated in Notion (" +
+                            type(task).__name__ + ")"])
+        elif task is None:
+            results.append([update[0], "Could not be updated in Notion"])
+        else:
+            results.append([update[0], "Updated " + ", ".join(update[2])])
+
+    if len(results) == 0:
+        await botHelper.errorMessage(ctx, "No updates were given")
     else:
-        deleteList.append(taskName)
-        await botHelper.displayTaskInfo_name(ctx, taskName,
-                                             taskName + " Pending Deletion")
+        await botHelper.sendSummary(ctx, "Bulk Update Summary", results)
+
+
+# Description: Get the scope of a user's pending deletions. Tasks marked
+# 			   for deletion by one user in one server can only be confirmed
+# 			   by that user in that server
+# @return: (guild ID, requester ID), guild ID is 0 in direct messages
+def deletionScope(ctx):
+    guildID = ctx.guild.id if ctx.guild is not None else 0
+    return guildID, ctx.author.id
+
+
+# Description: Get the tasks a user marked for deletion, oldest first
+# @return: list of Tasks
+async def pendingDeleteTasks(ctx):
+    await notionCache.snapshot.ensureFresh()
+    tasks = []
+    for taskID in await asyncio.to_thread(taskStore.pendingDeletions,
+                                          *deletionScope(ctx)):
+        task = notionCache.snapshot.tasksByID.get(taskID)
+        if task is not None:
+            tasks.append(task)
+    return tasks
 
 
+# Description: Mark a task for deletion. It is deleted once the same user
+# 			   confirms it with $confirmDeleteTask
 @bot.command()
-async def confirmDeleteTask(ctx, taskName):
-    if len(deleteList) < 1:  # pendingList is empty
+async def deleteTask(ctx, taskName):
+    task = await notionCache.snapshot.findTask(taskName)
+    if task is None:
+        await botHelper.errorMessage(ctx, missingTaskMessage(taskName))
+    else:
+        await asyncio.to_thread(taskStore.addPendingDeletion,
+                                *deletionScope(ctx), task.id,
+                                time.time() + PENDING_DELETE_TTL)
+        await botHelper.displayTaskInfo_task(ctx, task,
+                                             task.name + " Pending Deletion")
+
+
+# Description: Delete tasks that the user marked for deletion. The tasks
+# 			   are archived in Notion concurrently
+# @param taskNames: names of the tasks delimitted by //, or nothing to
+# 					delete every task the user marked
+# Pre-condition: taskNames should follow the format -->
+# 	$confirmDeleteTask "taskName//taskName"
+@bot.command()
+async def confirmDeleteTask(ctx, *, taskNames=""):
+    pending = await pendingDeleteTasks(ctx)
+    if len(pending) < 1:
         await botHelper.errorMessage(ctx, "No tasks are pending deletion")
-    elif taskNameExists(taskName) == False:
-        await botHelper.errorMessage(
-            ctx,
-            "Task name does not exist\n" + "Use `$listDeleteTask` to view" +
-            " the list of tasks that are pending deletion")
+        return
+
+    results = []  # [taskName, outcome] for the summary
+    pendingByID = {task.id: task for task in pending}
+    if taskNames.strip().strip("\"").strip() == "":
+        tasks = pending
     else:
-        if taskName not in deleteList:
-            await botHelper.errorMessage(
-                ctx, taskName + " is not pending for deletion.\n" +
-                "use `$deleteTask \"task name\"` to put" +
-                " the task up for deletion")
-        else:  # Delete task from Notion
-            res = notionDB.deletePage(taskName)
-            if res == 200:
-                deleteList.remove(taskName)
-                notionDB.readDatabase()
-                embed = discord.Embed(title=taskName + " Removed!",
-                                      description="",
-                                      color=PURPLE)
-                await ctx.send(embed=embed)
-            else:
-                desc = (taskName + " could not be deleted from Notion. " +
-                        "Ask ask CI Tsang for help or report it to" +
-                        " the channel *bot-errors*")
-                await botHelper.errorMessage(ctx, desc)
+        tasks = []
+        for taskName in taskNames.strip().strip("\"").split("//"):
+            taskName = taskName.strip()
+            task = await notionCache.snapshot.findTask(taskName)
+            if task is None:
+                results.append([taskName, missingTaskMessage(taskName)])
+            elif task.id not in pendingByID:
+                results.append([
+                    taskName, "Not pending for deletion, use " +
+                    "`$deleteTask \"task name\"` to put it up for deletion"
+                ])
+            elif task not in tasks:
+                tasks.append(task)
+
+    ### delete tasks from Notion ###
+    # a failed request is reported with its task, the others still finish
+    deleted = await asyncio.gather(
+        *[notionDB.archivePage(task.id) for task in tasks],
+        return_exceptions=True)
+    await asyncio.to_thread(
+        taskStore.removePendingDeletions, *deletionScope(ctx),
+        [task.id for task, archived in zip(tasks, deleted)
+         if archived is not None and not isinstance(archived, BaseException)])
+    for task, archived in zip(tasks, deleted):
+        if isinstance(archived, BaseException):
+            print("Delete failed for", task.name, repr(archived))
+            results.append([
+                task.name, "Could not be deleted from Notion (" +
+                type(archived).__name__ + "). It is still pending deletion"
+            ])
+        elif archived is None:
+            results.append([
+                task.name, "Could not be deleted from Notion. Report it " +
+                "to the channel *bot-errors*"
+            ])
+        else:
+            results.append([task.name, "Removed!"])
+
+    await botHelper.sendSummary(ctx, "Delete Summary", results)
 
 
-# Description: List all tasks that are pending deletion
+# Description: List the tasks the user marked for deletion
 @bot.command()
 async def listDeleteTasks(ctx):
-    # pendingList is empty
-    if len(deleteList) < 1:
+    tasks = await pendingDeleteTasks(ctx)
+    if len(tasks) < 1:
         await botHelper.errorMessage(ctx, "No tasks pending deletion!")
-    # display on items in the pendingList
     else:
-        index = 1
-        await ctx.send("**__Pending Deletion Task List__**")
-        for taskName in deleteList:
-            pageInfo = notionDB.getPage(taskName)
-
-            # extract the page information
-            taskName = pageInfo["name"]
-            desc = pageInfo["description"]
-            completion = "Yes" if pageInfo["completion"] == True else "No"
-            dateTime = pageInfo["dateTime"]
-            assignedTo = ", ".join(pageInfo["assignedTo"])
-            assignedBy = ", ".join(pageInfo["assignedBy"])
-            taskType = ", ".join(pageInfo["taskType"])
-            url = pageInfo["url"]
-            blank = " "
-            task = ("**----- Task: {9} -----**\n>>> " +
-                    "Task Name:\t{6}{6}{6}{0}\n" +
-                    "Description:\t{6}{6}{1}\n" + "Date & Time:\t{6}{2}\n" +
-                    "Assigned To:\t{6}{3}\n" + "Assigned By:\t{4}\n" +
-                    "Task Type:\t\t{6}{5}\n" + "Completion: \t{7}\n" +
-                    "Link: \t\t{8}").format(taskName, desc, dateTime,
-                                            assignedTo, assignedBy, taskType,
-                                            blank, completion, url, index)
-            await ctx.send(task)
-            index += 1
+        await botHelper.sendTaskPages(ctx, "Pending Deletion Task List",
+                                      tasks)
 
 
 @bot.command()
 async def completeTask(ctx, taskName):
     # check task completion
-    pageInfo = notionDB.getPage(taskName)
-    completion = pageInfo["completion"]
-    if completion:
+    task = await notionDB.getPage(taskName)
+    if task is None:
+        await botHelper.errorMessage(ctx, missingTaskMessage(taskName))
+    elif task.completion:
         desc = taskName + " was already completed"
         embed = discord.Embed(title="Task is Complete",
                               description=desc,
                               color=PURPLE)
         await ctx.send(embed=embed)
     else:
-        notionDB.updatePage(taskName, 7, True)
-        notionDB.readDatabase()
-        await botHelper.displayTaskInfo_name(ctx, taskName, "Task Updated!")
+        task = await notionDB.updatePage(taskName, 7, True)
+        if task is not None:
+            await botHelper.displayTaskInfo_task(ctx, task, "Task Updated!")
+        else:
+            desc = (taskName + " could not be updated. " +
+                    "Ask ask CI Tsang for help or report it to" +
+                    " the channel *bot-errors*")
+            await botHelper.errorMessage(ctx, desc)
 
 
 # Description: List all fields for a task
@@ -538,7 +728,7 @@ async def listFields(ctx):
 @bot.command()
 async def listTags(ctx):
     embed = discord.Embed(title="Avaliable Tags for Task Creation",
-                          description=botHelper.listTagNames(tagNames),
+                          description=await botHelper.listTagNames(tagNames),
                           color=PURPLE)
     await ctx.send(embed=embed)
 
@@ -546,9 +736,8 @@ async def listTags(ctx):
 # Description: List all tasks assigned to a specfic person
 @bot.command()
 async def listTasks(ctx, assignedTo):
-    notionDB.readDatabase()
     # validate if assignedTo tag exists
-    valid = listValidation(assignedTo, 0)
+    valid = await listValidation(assignedTo, 0)
     if (valid[0] != 0):
         list = ", ".join(valid[1:])
         await botHelper.errorMessage(
@@ -556,15 +745,90 @@ async def listTasks(ctx, assignedTo):
             "The following \"Assign To\" tags" + " are incorrect: \t" + list)
 # print all tasks assigned to the assignedTo
     else:
-        await botHelper.printPersonTasks(ctx, assignedTo)
+        await botHelper.printPersonTasks(ctx, valid[1:])
+
+
+# Description: Find the tasks that match every given filter. The tasks are
+# 			   looked up in the cached indexes instead of Notion
+# @param data: filters delimitted by //, each written as filter: value
+# Pre-condition: data should follow the format -->
+# 	$findTasks to: tags // by: tags // type: tags // done: yes/no //
+# 	after: 01 Jan 22 1300 // before: 01 Jan 22 1300 // desc: text
+# 	where every filter is optional
+@bot.command()
+async def findTasks(ctx, *, data=""):
+    tags = [[], [], []]
+    completion = None
+    dueAfter = None
+    dueBefore = None
+    text = None
+    msg = ""
+
+    ### data validation ###
+    for part in data.strip().strip("\"").split("//"):
+        if part.strip() == "":
+            continue
+        if ":" not in part:
+            msg = "Filters must be written as filter: value"
+            break
+        name, value = part.split(":", 1)
+        name = name.strip().lower()
+        value = value.strip()
+
+        if name in tagFilters:
+            valid = await listValidation(value, tagFilters[name])
+            if valid[0] == -1:
+                msg = "No \"" + name + "\" tags avaliable"
+            elif valid[0] == 1:
+                msg = ("The following \"" + name + "\" tags are incorrect: \t" +
+                       ", ".join(valid[1:]))
+            else:
+                tags[tagFilters[name]] = valid[1:]
+        elif name == "done":
+            if value.lower() in ["yes", "y", "true"]:
+                completion = True
+            elif value.lower() in ["no", "n", "false"]:
+                completion = False
+            else:
+                msg = "done must be yes or no"
+        elif name == "after" or name == "before":
+            date = parseDateTime(value)
+            if date is None:
+                msg = ("Dates must be written as [01 Jan 22 1300], " +
+                       value + " is not")
+            elif name == "after":
+                dueAfter = date
+            else:
+                dueBefore = date
+        elif name == "desc":
+            text = value
+        else:
+            msg = ("Unknown filter " + name + ". Filters are " +
+                   "to, by, type, done, after, before and desc")
+        if msg != "":
+            break
+
+    if msg != "":
+        await botHelper.errorMessage(ctx, msg)
+        return
+
+    tasks = await notionCache.snapshot.findTasks(tags, completion, dueAfter,
+                                                 dueBefore, text)
+    if len(tasks) == 0:
+        embed = discord.Embed(title="Find Tasks",
+                              description="No tasks match the filters",
+                              color=PURPLE)
+        await ctx.send(embed=embed)
+    else:
+        await botHelper.sendTaskPages(
+            ctx, "Found {0} tasks".format(len(tasks)), tasks)
 
 
 # # Description: List all tasks assigned to the caller
 @bot.command()
 async def listMyTasks(ctx):
-    notionDB.readDatabase()
     # validate author name
-    valid = listValidation(ctx.author.display_name, 0)
+    valid = await listValidation(ctx.author.display_name, 0)
     if (valid[0] != 0):
         list = ", ".join(valid[1:])
         await botHelper.errorMessage(
@@ -574,7 +838,31 @@ async def listMyTasks(ctx):
 
 # print all tasks assigned to the user that sent the command
     else:
-        await botHelper.printPersonTasks(ctx, ctx.author.display_name)
+        await botHelper.printPersonTasks(ctx, valid[1:])
+
+
+# Description: Show how fresh the cached Notion data is
+@bot.command()
+async def cacheStatus(ctx):
+    stats = notionCache.snapshot.stats()
+    staleness = stats["staleness"]
+    duration = stats["lastSyncDuration"]
+    desc = ("Cached tasks:\t{0}\n".format(stats["pages"]) +
+            "Last synced:\t{0}\n".format(
+                "never" if staleness is None else
+                "{0:.0f}s ago".format(staleness)) +
+            "Sync duration:\t{0}\n".format(
+                "N/A" if duration is None else "{0:.2f}s".format(duration)) +
+            "Tasks changed:\t{0}\n".format(stats["lastSyncChanged"]) +
+            "Refresh interval:\t{0:.0f}s\n".format(
+                notionRefresh.refreshLoop.seconds) +
+            "Warm start:\t{0}\n".format(
+                "Yes" if stats["warmStart"] else "No") +
+            "First command:\t{0}".format(
+                "N/A" if firstCommandTime is None else
+                "{0:.2f}s after start".format(firstCommandTime)))
+    embed = discord.Embed(title="Cache Status", description=desc, color=PURPLE)
+    await ctx.send(embed=embed)
 
 
 @bot.command()
@@ -583,21 +871,25 @@ async def listCommands(ctx):
         "**$newTask**             --> create a new task for Notion\n" +
         "**$getTask**             --> view a specific task from Notion\n" +
         "**$updateTask**          --> update a task's information\n" +
+        "**$bulkUpdateTask**      --> update many tasks, one per line\n" +
         "**$completeTask**        --> mark a task as complete\n" +
         "**$deleteTask**          --> mark a task for deletion\n" +
-        "**$confirmDeleteTask**   --> delete a task from Notion\n" +
+        "**$confirmDeleteTask**   --> delete tasks marked for deletion from Notion\n" +
         "**$listDeleteTasks**     --> view all tasks marked for deletion\n" +
         "**$listFields**          --> view all Notion header\n" +
         "**$listTags**            --> view all tags for Assigned To, Assigned By and  Type headers\n"
         +
         "**$listTasks**           --> view all tasks assigned to a particular person\n"
         + "**$listMyTasks**         --> view all tasks assigned to you\n" +
+        "**$findTasks**           --> find tasks by tags, completion, date or description\n" +
+        "**$cacheStatus**         --> view how fresh the cached Notion data is\n" +
         "**$listCommands**        --> view all bot commands\n")
 
     embed = discord.Embed(title="Bot Commands", description=msg, color=PURPLE)
     await ctx.send(embed=embed)
 
 
-# run the bot
-keep_alive()  # run the websever
-bot.run(os.getenv("TOKEN"))
+# run the bot, the keep alive server is started in setup_hook. The
+# commands can be imported without connecting (i.e. by benchmark.py)
+if __name__ == "__main__":
+    bot.run(os.getenv("TOKEN"))
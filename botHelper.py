@@ -11,8 +11,9 @@ from discord.ext import commands
 import os
 import datetime as dt
 from datetime import timedelta
-import json
 import notionDB
+import notionCache
+import taskModel
 
 #############
 # CONSTANTS #
@@ -24,19 +25,22 @@ RED = 0xa83252
 PURPLE = 0xaa50de
 YELLOW = 0xFFFF00
 
+# Discord limits the description of an embed to 4096 characters
+EMBED_DESC_LIMIT = 4096
+# seconds the page buttons of a task list keep working
+PAGES_TIMEOUT = 300
+
 ####################
 # HELPER FUNCTIONS #
 ####################
 
 
-# Description: Read tags.json and format the names for each
+# Description: Read the cached tags and format the names for each
 # 			   tag into a list. In addition, update the
 # 			   global variable tagNames
-def listTagNames(tagNames):
-    # load the json file contents
-    notionDB.readDatabase()
-    with open("./tags.json") as f:
-        data = json.load(f)
+async def listTagNames(tagNames):
+    # load the cached tags
+    data = await notionCache.snapshot.getTags()
 
 # store names of assignToIDs
     list = data[0]["assignToIDs"]
@@ -71,53 +75,55 @@ def listTagNames(tagNames):
 # @return: embed of the page information
 # Pre-condition: Task name is guaranteed to be in the database
 async def displayTaskInfo_name(ctx, taskName, title):
-    pageInfo = notionDB.getPage(taskName)
-
-    # extract the page information
-    taskName = pageInfo["name"]
-    desc = pageInfo["description"]
-    completion = "Yes" if pageInfo["completion"] == True else "No"
-    dateTime = pageInfo["dateTime"]
-    assignedTo = ", ".join(pageInfo["assignedTo"])
-    assignedBy = ", ".join(pageInfo["assignedBy"])
-    taskType = ", ".join(pageInfo["taskType"])
-    url = pageInfo["url"]
-    blank = " "
-    task = ("Task Name:\t{6}{6}{6}{0}\n" + "Description:\t{6}{6}{1}\n" +
-            "Date & Time:\t{6}{2}\n" + "Assigned To:\t{6}{3}\n" +
-            "Assigned By:\t{4}\n" + "Task Type:\t\t{6}{5}\n" +
-            "Completion: \t{7}\n" + "Link: \t\t{8}").format(
-                taskName, desc, dateTime, assignedTo, assignedBy, taskType,
-                blank, completion, url)
-
-    embed = discord.Embed(title=title, description=task, color=PURPLE)
-    await ctx.send(embed=embed)
+    task = await notionDB.getPage(taskName)
+    await displayTaskInfo_task(ctx, task, title)
 
 
 # Description: Create an embed for the caller function to post in a model
-# @param data: String of data in the // format
+# @param task: Task to display
 # @param title: Title of the model
 # @return: embed of the page information
-# Pre-condition: data is guaranteed to be in teh correct format
-async def displayTaskInfo_str(ctx, data, title):
-    # split the data into its components
-    dataSplit = data.split("//")
-    taskName = dataSplit[0].strip()
-    desc = dataSplit[1].strip()
-    dateTime = dataSplit[2].strip()
-    assignedTo = dataSplit[3].strip()
-    assignedBy = dataSplit[4].strip()
-    taskType = dataSplit[5].strip()
-
-    # create embed
+async def displayTaskInfo_task(ctx, task, title):
+    embed = discord.Embed(title=title,
+                          description=formatTaskInfo(task),
+                          color=PURPLE)
+    if staleMessage() != "":
+        embed.set_footer(text=staleMessage())
+    await ctx.send(embed=embed)
+
+
+# Description: Warn users when the tasks shown were loaded from the last
+# 			   run and have not been synced with Notion yet
+# @return: the warning, or a blank string if the tasks are synced
+def staleMessage():
+    snapshot = notionCache.snapshot
+    if not snapshot.isWarmStart():
+        return ""
+    staleness = snapshot.staleness()
+    return ("Saved data from {0:.0f} minutes ago, ".format(staleness / 60) +
+            "syncing with Notion")
+
+
+# Description: Format a task as the text of a model
+# @param task: Task to format
+# @return: the formatted task information
+def formatTaskInfo(task):
+    # extract the task information
+    taskName = task.name
+    desc = task.description
+    completion = "Yes" if task.completion == True else "No"
+    dateTime = taskModel.formatDue(task)
+    assignedTo = ", ".join(task.assignedTo)
+    assignedBy = ", ".join(task.assignedBy)
+    taskType = ", ".join(task.taskType)
+    url = task.url
     blank = " "
-    task = ("Task Name:\t{6}{6}{6}{0}\n" + "Description:\t{6}{6}{1}\n" +
+    return ("Task Name:\t{6}{6}{6}{0}\n" + "Description:\t{6}{6}{1}\n" +
             "Date & Time:\t{6}{2}\n" + "Assigned To:\t{6}{3}\n" +
-            "Assigned By:\t{4}\n" + "Task Type:\t\t{6}{5}").format(
+            "Assigned By:\t{4}\n" + "Task Type:\t\t{6}{5}\n" +
+            "Completion: \t{7}\n" + "Link: \t\t{8}").format(
                 taskName, desc, dateTime, assignedTo, assignedBy, taskType,
-                blank)
-    embed = discord.Embed(title=title, description=task, color=GREEN)
-    await ctx.send(embed=embed)
+                blank, completion, url)
 
 
 # Description: Create an embed for an error
@@ -126,59 +132,111 @@ async def errorMessage(ctx, desc):
     await ctx.send(embed=embed)
 
 
+# Description: Send one embed listing what happened to each task of a
+# 			   command that changes many tasks
+# @param title: Title of the embed
+# @param results: list of [taskName, outcome]
+async def sendSummary(ctx, title, results):
+    desc = "\n".join("**" + taskName + "**: " + outcome
+                     for taskName, outcome in results)
+    embed = discord.Embed(title=title,
+                          description=desc[:EMBED_DESC_LIMIT],
+                          color=PURPLE)
+    await ctx.send(embed=embed)
+
+
 # Description: Display all the tasks that have assigned to assignedTo
+# @param assignedTo: list of validated "Assigned To" tag names
 async def printPersonTasks(ctx, assignedTo):
-    tasks = []
-    with open("./pages.json") as f:
-        pages = json.load(f)
-
-    for page in pages:
-        assignedList = page["properties"]["Assigned to"]["multi_select"]
-        for tag in assignedList:
-            if tag["name"] == assignedTo:
-                tasks.append(page)
+    snapshot = notionCache.snapshot
+    if snapshot.isLoaded():
+        # indexed lookup in the snapshot, sorted by due date
+        tasks = await snapshot.findTasks([assignedTo, [], []])
+    else:
+        # nothing is synced yet, only the matching tasks are sent by Notion
+        query = notionDB.buildQuery(assignedTo=assignedTo)
+        tasks = [
+            taskModel.taskFromPage(page)
+            async for page in notionDB.iterPages(query)
+        ]
 
     if len(tasks) == 0:
-        message = discord.Embed(title="Tasks for " + assignedTo + ":",
+        message = discord.Embed(title="Tasks for " + ", ".join(assignedTo) +
+                                ":",
                                 description="No tasks! Congradulations!",
                                 color=GREEN)
         await ctx.send(embed=message)
 
     else:
-        index = 1
-        for task in tasks:
-            assignedToList = []
-            assignedByList = []
-            typeList = []
-
-            for tag in task["properties"]["Assigned to"]["multi_select"]:
-                assignedToList.append(tag["name"])
-
-            for tag in task["properties"]["Assigned by"]["multi_select"]:
-                assignedByList.append(tag["name"])
-
-            for tag in task["properties"]["Type"]["multi_select"]:
-                typeList.append(tag["name"])
-
-            taskName = (
-                task["properties"]["Task"]["title"][0]["text"]["content"])
-            desc = (task["properties"]["Description"]["rich_text"][0]["text"]
-                    ["content"])
-            completion = ("Yes" if
-                          (task["properties"]["Completion"]["checkbox"])
-                          == True else "No")
-            dateTime = task["properties"]["Date"]["date"]["start"]
-            assignedTo = ", ".join(assignedToList)
-            assignedBy = ", ".join(assignedByList)
-            taskType = ", ".join(typeList)
-            url = task["url"]
-            blank = " "
-            t = ("**----- Task: {9} -----**\n>>> " +
-                 "Task Name:\t{6}{6}{6}{0}\n" + "Description:\t{6}{6}{1}\n" +
-                 "Date & Time:\t{6}{2}\n" + "Assigned To:\t{6}{3}\n" +
-                 "Assigned By:\t{4}\n" + "Task Type:\t\t{6}{5}\n" +
-                 "Completion: \t{7}\n" + "Link: \t\t{8}").format(
-                     taskName, desc, dateTime, assignedTo, assignedBy,
-                     taskType, blank, completion, url, index)
-            await ctx.send(t)
-            index += 1
+        await sendTaskPages(ctx, "Tasks for " + ", ".join(assignedTo), tasks)
+
+
+# Description: Pack tasks into as few embeds as fit Discord's limits
+# @param title: Title of every embed
+# @param tasks: list of Tasks
+# @return: list of embeds, one per page of tasks
+def buildTaskEmbeds(title, tasks):
+    descriptions = [""]
+    for i in range(0, len(tasks)):
+        task = ("**----- Task: {0} -----**\n".format(i + 1) +
+                formatTaskInfo(tasks[i]) + "\n\n")
+        task = task[:EMBED_DESC_LIMIT]
+        if len(descriptions[-1]) + len(task) > EMBED_DESC_LIMIT:
+            descriptions.append("")
+        descriptions[-1] += task
+
+    embeds = []
+    for i in range(0, len(descriptions)):
+        embed = discord.Embed(title=title,
+                              description=descriptions[i],
+                              color=PURPLE)
+        footer = "Page {0} of {1}".format(i + 1, len(descriptions))
+        if staleMessage() != "":
+            footer += " | " + staleMessage()
+        embed.set_footer(text=footer)
+        embeds.append(embed)
+    return embeds
+
+
+# Description: Send a list of tasks as one message. When the tasks do not
+# 			   fit in one embed, buttons flip between the pages
+# @param title: Title of the message
+# @param tasks: list of Tasks
+async def sendTaskPages(ctx, title, tasks):
+    embeds = buildTaskEmbeds(title, tasks)
+    if len(embeds) == 1:
+        await ctx.send(embed=embeds[0])
+    else:
+        view = TaskPages(embeds)
+        view.message = await ctx.send(embed=embeds[0], view=view)
+
+
+# Description: Previous and next buttons for a paginated task list
+class TaskPages(discord.ui.View):
+
+    def __init__(self, embeds):
+        super().__init__(timeout=PAGES_TIMEOUT)
+        self.embeds = embeds
+        self.index = 0
+        self.message = None
+
+    # Description: Show the embed at index after a button is pressed
+    async def showPage(self, interaction, index):
+        self.index = index % len(self.embeds)
+        await interaction.response.edit_message(embed=self.embeds[self.index],
+                                                view=self)
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def prevPage(self, interaction, button):
+        await self.showPage(interaction, self.index - 1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def nextPage(self, interaction, button):
+        await self.showPage(interaction, self.index + 1)
+
+    # Description: Disable the buttons once they stop working
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            await self.message.edit(view=self)
@@ -0,0 +1,91 @@
+###
+# botMetrics.py
+#
+# Description: Prometheus metrics for the bot. Commands, Notion requests
+#              and the snapshot record here, and the keep alive server
+#              exports them on /metrics.
+###
+
+import re
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, Counter, Gauge,
+                               Histogram, generate_latest)
+
+#############
+# CONSTANTS #
+#############
+
+# Notion page and database IDs, with or without dashes
+NOTION_ID = re.compile(r"[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?"
+                       r"[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}")
+
+###########
+# METRICS #
+###########
+
+commandLatency = Histogram("bot_command_seconds",
+                           "Time taken to run a bot command",
+                           ["command", "result"])
+
+notionRequests = Counter("notion_requests_total",
+                         "Requests sent to the Notion API",
+                         ["method", "endpoint", "status"])
+notionLatency = Histogram("notion_request_seconds",
+                          "Time taken by a request to the Notion API",
+                          ["method", "endpoint"])
+notionRateLimited = Counter("notion_rate_limited_total",
+                            "Requests rejected by Notion with a 429",
+                            ["method", "endpoint"])
+
+cacheLookups = Counter("snapshot_lookups_total",
+                       "Snapshot reads, a miss had to sync with Notion first",
+                       ["result"])
+snapshotPages = Gauge("snapshot_pages", "Number of tasks in the snapshot")
+syncDuration = Histogram("snapshot_sync_seconds",
+                         "Time taken to sync the snapshot with Notion",
+                         ["kind"])
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Get the endpoint of a Notion URL with the IDs removed, so
+# 			   every page shares one label (i.e. /pages/{id})
+def endpoint(url, baseURL):
+    if url.startswith(baseURL):
+        url = url[len(baseURL):]
+    return NOTION_ID.sub("{id}", url.split("?")[0])
+
+
+# Description: Record a finished Notion request
+# @param status: HTTP status, or None after a network error
+def observeRequest(method, url, baseURL, status, seconds):
+    path = endpoint(url, baseURL)
+    notionRequests.labels(method, path, str(status)).inc()
+    notionLatency.labels(method, path).observe(seconds)
+    if status == 429:
+        notionRateLimited.labels(method, path).inc()
+
+
+# Description: Start timing a command. Used as the bot's before_invoke hook
+async def beforeCommand(ctx):
+    ctx.metricsStart = time.perf_counter()
+
+
+# Description: Record how long a command took. Used as the bot's
+# 			   after_invoke hook, which also runs when the command fails
+async def afterCommand(ctx):
+    start = getattr(ctx, "metricsStart", None)
+    if start is None:
+        return
+    result = "error" if ctx.command_failed else "ok"
+    commandLatency.labels(ctx.command.qualified_name,
+                          result).observe(time.perf_counter() - start)
+
+
+# Description: Get every metric in the Prometheus text format
+# @return: (body, content type)
+def export():
+    return generate_latest(), CONTENT_TYPE_LATEST
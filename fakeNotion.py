@@ -0,0 +1,317 @@
+###
+# fakeNotion.py
+#
+# Description: Local stand-in for the parts of the Notion API used by the
+#              bot, for benchmarks and offline testing. Pages are kept in
+#              memory and the server can add latency and answer with 429s.
+#
+# Usage: python fakeNotion.py [pages] [port]
+#        then run the bot with NOTION_URL=http://localhost:port/v1
+###
+
+from aiohttp import web
+import asyncio
+import datetime as dt
+import random
+import sys
+import uuid
+
+#############
+# CONSTANTS #
+#############
+
+DEFAULT_PORT = 8001
+DATABASE_ID = "bench0000000000000000000000000000"
+
+# tags of the fake database, same properties as the real one
+ASSIGNED_TO_TAGS = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank"]
+ASSIGNED_BY_TAGS = ["Alice", "Bob", "Carol"]
+TYPE_TAGS = ["Meeting", "Design", "Review", "Writing"]
+
+# largest page size Notion allows
+MAX_PAGE_SIZE = 100
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Current time in the format of Notion's timestamps
+def timestamp():
+    now = dt.datetime.now(dt.timezone.utc)
+    return now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+# Description: Convert rich text sent by the bot into the rich text Notion
+# 			   returns
+def richText(items):
+    return [{
+        "type": "text",
+        "text": {"content": item["text"]["content"], "link": None},
+        "plain_text": item["text"]["content"]
+    } for item in items]
+
+
+# Description: Check that a page matches a database query filter. Supports
+# 			   the filters built by notionDB
+def matches(page, query):
+    if "and" in query:
+        return all(matches(page, part) for part in query["and"])
+    if "or" in query:
+        return any(matches(page, part) for part in query["or"])
+
+    if query.get("timestamp") == "last_edited_time":
+        value = page["last_edited_time"]
+        condition = query["last_edited_time"]
+    else:
+        property = page["properties"][query["property"]]
+        if "multi_select" in query:
+            names = [tag["name"] for tag in property["multi_select"]]
+            return query["multi_select"]["contains"] in names
+        if "checkbox" in query:
+            return property["checkbox"] == query["checkbox"]["equals"]
+        if property["date"] is None:
+            return False
+        value = property["date"]["start"]
+        condition = query["date"]
+
+    if "on_or_after" in condition:
+        return value >= condition["on_or_after"]
+    if "on_or_before" in condition:
+        return value <= condition["on_or_before"]
+    return True
+
+
+# Description: Sort key for the sorts of a database query. Pages without a
+# 			   date go last
+def sortKey(sort):
+    if sort.get("timestamp") == "last_edited_time":
+        return lambda page: page["last_edited_time"]
+    return lambda page: ((page["properties"]["Date"]["date"] or {}).get(
+        "start") or "~")
+
+
+class FakeNotion:
+
+    # @param pages: number of pages created in the database
+    # @param latency: seconds added to every request
+    # @param rateLimitChance: chance (0 to 1) of answering with a 429
+    # @param retryAfter: seconds sent in the Retry-After header of a 429
+    def __init__(self, pages=100, latency=0, rateLimitChance=0,
+                 retryAfter=0.1):
+        self.latency = latency
+        self.rateLimitChance = rateLimitChance
+        self.retryAfter = retryAfter
+
+        # number of requests received, by "METHOD route"
+        self.calls = {}
+        self.rateLimited = 0
+
+        self.options = {
+            "Assigned to": self.makeOptions(ASSIGNED_TO_TAGS),
+            "Assigned by": self.makeOptions(ASSIGNED_BY_TAGS),
+            "Type": self.makeOptions(TYPE_TAGS)
+        }
+        # pages keyed by ID, in creation order
+        self.pages = {}
+        self.seed(pages)
+
+        self.app = web.Application(middlewares=[self.middleware])
+        self.app.add_routes([
+            web.get("/v1/databases/{id}", self.getDatabase),
+            web.post("/v1/databases/{id}/query", self.queryDatabase),
+            web.post("/v1/pages", self.createPage),
+            web.get("/v1/pages/{id}", self.getPage),
+            web.patch("/v1/pages/{id}", self.updatePage)
+        ])
+        self.runner = None
+
+    # Description: Total number of requests received
+    def totalCalls(self):
+        return sum(self.calls.values())
+
+    # Description: Create the options of a multi select property
+    def makeOptions(self, names):
+        return [{"id": str(uuid.uuid4()), "name": name, "color": "default"}
+                for name in names]
+
+    # Description: Get the options for a list of tag names, creating the
+    # 			   options that do not exist like Notion does
+    def selectOptions(self, property, tags):
+        options = self.options[property]
+        selected = []
+        for tag in tags:
+            option = next((o for o in options if o["name"] == tag["name"]),
+                          None)
+            if option is None:
+                option = self.makeOptions([tag["name"]])[0]
+                options.append(option)
+            selected.append(option)
+        return selected
+
+    # Description: Fill the database with generated tasks. The same count
+    # 			   always gives the same tasks
+    def seed(self, count):
+        start = dt.datetime(2030, 1, 1, 9)
+        for i in range(0, count):
+            due = start + dt.timedelta(hours=7 * i)
+            assignedTo = ASSIGNED_TO_TAGS[i % len(ASSIGNED_TO_TAGS)]
+            assignedBy = ASSIGNED_BY_TAGS[i % len(ASSIGNED_BY_TAGS)]
+            taskType = TYPE_TAGS[i % len(TYPE_TAGS)]
+            self.addPage({
+                "Task": {"title": [{"text": {"content": "task " + str(i)}}]},
+                "Description": {
+                    "rich_text": [{"text": {"content": "generated task"}}]
+                },
+                "Date": {"date": {"start": due.isoformat()}},
+                "Assigned to": {"multi_select": [{"name": assignedTo}]},
+                "Assigned by": {"multi_select": [{"name": assignedBy}]},
+                "Type": {"multi_select": [{"name": taskType}]},
+                "Completion": {"checkbox": i % 4 == 0}
+            })
+
+    # Description: Create a page from the properties sent by the bot
+    def addPage(self, properties):
+        id = str(uuid.uuid4())
+        now = timestamp()
+        page = {
+            "object": "page",
+            "id": id,
+            "created_time": now,
+            "last_edited_time": now,
+            "created_by": {"object": "user", "id": "bench"},
+            "last_edited_by": {"object": "user", "id": "bench"},
+            "cover": None,
+            "icon": None,
+            "parent": {"type": "database_id", "database_id": DATABASE_ID},
+            "archived": False,
+            "in_trash": False,
+            "url": "https://www.notion.so/" + id.replace("-", ""),
+            "properties": {
+                "Task": {"title": []},
+                "Description": {"rich_text": []},
+                "Date": {"date": None},
+                "Assigned to": {"multi_select": []},
+                "Assigned by": {"multi_select": []},
+                "Type": {"multi_select": []},
+                "Completion": {"checkbox": False}
+            }
+        }
+        self.setProperties(page, properties)
+        self.pages[id] = page
+        return page
+
+    # Description: Apply properties sent by the bot to a page
+    def setProperties(self, page, properties):
+        for name, value in properties.items():
+            if "title" in value:
+                value = {"title": richText(value["title"])}
+            elif "rich_text" in value:
+                value = {"rich_text": richText(value["rich_text"])}
+            elif "multi_select" in value:
+                value = {
+                    "multi_select": self.selectOptions(name,
+                                                       value["multi_select"])
+                }
+            page["properties"][name] = value
+        page["last_edited_time"] = timestamp()
+
+    ############
+    # HANDLERS #
+    ############
+
+    # Description: Count every request, then add latency and 429s
+    @web.middleware
+    async def middleware(self, request, handler):
+        resource = request.match_info.route.resource
+        route = request.method + " " + (resource.canonical
+                                        if resource else request.path)
+        self.calls[route] = self.calls.get(route, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.rateLimitChance:
+            self.rateLimited += 1
+            return web.json_response(
+                {
+                    "object": "error",
+                    "status": 429,
+                    "code": "rate_limited",
+                    "message": "You have been rate limited."
+                },
+                status=429,
+                headers={"Retry-After": str(self.retryAfter)})
+        return await handler(request)
+
+    async def getDatabase(self, request):
+        return web.json_response({
+            "object": "database",
+            "id": DATABASE_ID,
+            "title": [],
+            "properties": {
+                name: {"multi_select": {"options": options}}
+                for name, options in self.options.items()
+            }
+        })
+
+    # Description: Query the database with a filter, sorts and cursors.
+    # 			   The cursor is the position of the next page
+    async def queryDatabase(self, request):
+        body = await request.json()
+        pages = [page for page in self.pages.values() if not page["archived"]]
+        if "filter" in body:
+            pages = [page for page in pages if matches(page, body["filter"])]
+        for sort in reversed(body.get("sorts", [])):
+            pages.sort(key=sortKey(sort),
+                       reverse=sort.get("direction") == "descending")
+
+        start = int(body.get("start_cursor") or 0)
+        end = start + min(body.get("page_size", MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        return web.json_response({
+            "object": "list",
+            "results": pages[start:end],
+            "has_more": end < len(pages),
+            "next_cursor": str(end) if end < len(pages) else None
+        })
+
+    async def createPage(self, request):
+        body = await request.json()
+        return web.json_response(self.addPage(body["properties"]))
+
+    async def getPage(self, request):
+        page = self.pages.get(request.match_info["id"])
+        if page is None:
+            return web.json_response({"object": "error", "status": 404},
+                                     status=404)
+        return web.json_response(page)
+
+    # Description: Update the properties of a page or archive it
+    async def updatePage(self, request):
+        page = self.pages.get(request.match_info["id"])
+        if page is None:
+            return web.json_response({"object": "error", "status": 404},
+                                     status=404)
+        body = await request.json()
+        self.setProperties(page, body.get("properties", {}))
+        if "archived" in body:
+            page["archived"] = body["archived"]
+            page["in_trash"] = body["archived"]
+        return web.json_response(page)
+
+    # Description: Start serving on the running event loop
+    async def start(self, port=DEFAULT_PORT):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "localhost", port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+if __name__ == "__main__":
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    print("Fake Notion database {0} with {1} pages on "
+          "http://localhost:{2}/v1".format(DATABASE_ID, pages, port))
+    web.run_app(FakeNotion(pages).app, host="localhost", port=port)
@@ -1,18 +1,141 @@
-from flask import Flask
-from threading import Thread
+###
+# keepAlive.py
+#
+# Description: HTTP server for uptime pingers, health checks, metrics and
+#              Notion webhooks. It runs on the bot's event loop and is started
+#              and stopped with the bot.
+###
 
-app = Flask('')
+from aiohttp import web
+import hashlib
+import hmac
+import math
+import os
 
+import botMetrics
+import notionCache
+import notionEvents
 
-@app.route('/')
-def home():
-    return "Hello, I am alive"
+#############
+# CONSTANTS #
+#############
 
+PORT = int(os.getenv("PORT", "8000"))
 
-def run():
-    app.run(host='0.0.0.0', port=8000)
+# set to 1 to accept unsigned webhook events when NOTION_WEBHOOK_SECRET is
+# not set. Only for local testing, the server listens on every interface
+WEBHOOK_INSECURE = os.getenv("NOTION_WEBHOOK_INSECURE", "0") == "1"
 
+####################
+# GLOBAL VARIABLES #
+####################
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+app = web.Application()
+runner = None
+
+
+async def home(request):
+    return web.Response(text="Hello, I am alive")
+
+
+# Description: Liveness check with the Discord gateway latency and how
+# 			   fresh the cached Notion data is
+async def healthz(request):
+    bot = request.app["bot"]
+    latency = bot.latency
+    stats = notionCache.snapshot.stats()
+    body = {
+        "status": "closed" if bot.is_closed() else "ok",
+        "gatewayLatency": None if math.isnan(latency) else latency,
+        "cacheStaleness": stats["staleness"],
+        "lastSyncDuration": stats["lastSyncDuration"],
+        "warmStart": stats["warmStart"]
+    }
+    return web.json_response(body, status=503 if bot.is_closed() else 200)
+
+
+# Description: Readiness check. Ready once the bot is connected to Discord
+# 			   and the Notion snapshot is loaded
+async def readyz(request):
+    bot = request.app["bot"]
+    body = {
+        "discordReady": bot.is_ready(),
+        "snapshotLoaded": notionCache.snapshot.isLoaded(),
+        "tasks": len(notionCache.snapshot.tasksByID)
+    }
+    ready = body["discordReady"] and body["snapshotLoaded"]
+    return web.json_response(body, status=200 if ready else 503)
+
+
+# Description: Export the bot's metrics in the Prometheus text format
+async def metrics(request):
+    body, contentType = botMetrics.export()
+    return web.Response(body=body, headers={"Content-Type": contentType})
+
+
+# Description: Check the X-Notion-Signature header against the webhook's
+# 			   verification token. Events are rejected when
+# 			   NOTION_WEBHOOK_SECRET is not set, unless WEBHOOK_INSECURE is
+def validSignature(body, signature):
+    secret = os.getenv("NOTION_WEBHOOK_SECRET")
+    if not secret:
+        return WEBHOOK_INSECURE
+    expected = "sha256=" + hmac.new(secret.encode(), body,
+                                    hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+# Description: Receive page created/updated/deleted events from a Notion
+# 			   webhook
+async def notionWebhook(request):
+    try:
+        event = await request.json()
+    except ValueError:
+        return web.Response(text="Invalid JSON", status=400)
+
+    # sent once when the subscription is created, the token is needed to
+    # verify the subscription in Notion
+    if "verification_token" in event:
+        print("Notion webhook verification token:",
+              event["verification_token"])
+        return web.Response(status=200)
+
+    body = await request.read()
+    if not validSignature(body, request.headers.get("X-Notion-Signature",
+                                                    "")):
+        return web.Response(text="Invalid signature", status=401)
+    if not notionEvents.pushEvent(event):
+        return web.Response(text="Bot is not ready", status=503)
+    return web.Response(status=202)
+
+
+app.add_routes([
+    web.get("/", home),
+    web.get("/healthz", healthz),
+    web.get("/readyz", readyz),
+    web.get("/metrics", metrics),
+    web.post("/notion/webhook", notionWebhook)
+])
+
+
+# Description: Start serving on the running event loop
+# @param bot: the Discord bot reported on by the health checks
+async def start(bot):
+    global runner
+    app["bot"] = bot
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", PORT)
+    await site.start()
+    print("Keep alive server listening on port", PORT)
+    if not os.getenv("NOTION_WEBHOOK_SECRET") and not WEBHOOK_INSECURE:
+        print("Notion webhook events are rejected until "
+              "NOTION_WEBHOOK_SECRET is set")
+
+
+# Description: Stop serving and close open connections
+async def stop():
+    global runner
+    if runner is not None:
+        await runner.cleanup()
+        runner = None
@@ -0,0 +1,572 @@
+###
+# notionCache.py
+#
+# Description: Process-wide snapshot of the Notion tasks and tags.
+#              Commands read from the snapshot instead of refreshing
+#              the whole database on every call.
+###
+
+import asyncio
+import bisect
+import collections
+import datetime as dt
+import itertools
+import os
+import time
+
+import botMetrics
+import notionDB
+import taskModel
+import taskStore
+from notionScheduler import INTERACTIVE
+
+#############
+# CONSTANTS #
+#############
+
+# number of seconds before the snapshot is considered stale
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# number of seconds between full downloads of the database. Incremental
+# syncs cannot see archived pages, so a full sweep removes them
+FULL_SYNC_INTERVAL = float(os.getenv("FULL_SYNC_INTERVAL", "900"))
+
+# smallest trigram similarity (0 to 1) for a word to match a typed word,
+# and for a name to be suggested
+SUGGEST_THRESHOLD = 0.4
+# most names scored for a suggestion. Names with about as many words as
+# were typed are scored first
+MAX_SUGGEST_CANDIDATES = 50
+
+# keys of each tag list in the updateTags format
+# [{0: assignTo}, {1: assignBy}, {2: taskType}]
+TAG_KEYS = ["assignToIDs", "assignByIDs", "typeIDs"]
+
+class Snapshot:
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.tags = [{key: []} for key in TAG_KEYS]
+        self.lastRefresh = None
+        # wall clock time of the last sync, saved across restarts
+        self.lastSyncedAt = None
+        self.lastFullSync = None
+        # newest last_edited_time seen, pages edited since are synced
+        self.syncCursor = None
+
+        # set while the background loop keeps the snapshot warm
+        self.backgroundSync = False
+        # monitoring information about the last sync
+        self.lastSyncDuration = None
+        self.lastSyncChanged = None
+        # "full" or "incremental"
+        self.lastSyncKind = None
+
+        # tasks keyed by page ID
+        self.tasksByID = {}
+        # lowercase task name -> task
+        self.nameIndex = {}
+        # lowercase task name -> IDs of every task with that name. Tasks
+        # made in Notion can share a name
+        self.nameTasks = {}
+        # casefolded tag name -> canonical tag name, one per tag list
+        self.tagIndex = [{} for key in TAG_KEYS]
+        # tag name -> IDs of the tasks with the tag, one per tag list
+        self.tagTasks = [{} for key in TAG_KEYS]
+        # (due date, task ID) of every task with a date, sorted by date
+        self.dueIndex = []
+        # lowercase task names, sorted for prefix searches
+        self.sortedNames = []
+        # word of a lowercase name -> names that contain it
+        self.wordNames = {}
+        # trigram -> words that contain it
+        self.trigramIndex = {}
+        # word -> its trigrams
+        self.wordTrigrams = {}
+        # number of words -> lowercase names with that many words
+        self.wordCountNames = {}
+        # functions called with every task that is added or replaced
+        self.taskListeners = []
+
+    # Description: Check if the snapshot has expired or was never synced
+    #              since the bot started
+    def isStale(self):
+        if self.lastRefresh is None:
+            return True
+        return time.monotonic() - self.lastRefresh > self.ttl
+
+    # Description: Get the number of seconds since the snapshot was synced,
+    #              including syncs made before a restart
+    # @return: seconds, or None if it has never been synced
+    def staleness(self):
+        if self.lastSyncedAt is None:
+            return None
+        return time.time() - self.lastSyncedAt
+
+    # Description: Check if the snapshot was loaded from the task store and
+    #              has not been synced with Notion since the bot started
+    def isWarmStart(self):
+        return self.lastRefresh is None and self.lastSyncedAt is not None
+
+    # Description: Load the snapshot saved in the task store by the last run.
+    #              Like every task store call, it runs off the event loop
+    # @return: number of tasks loaded
+    async def load(self):
+        self.setTasks(await asyncio.to_thread(taskStore.loadTasks))
+        tags = await asyncio.to_thread(taskStore.loadTags)
+        # the tags are already saved
+        self.tags = tags
+        await self.setTags(tags)
+        meta = await asyncio.to_thread(taskStore.loadMeta)
+        self.syncCursor = meta.get("syncCursor")
+        if meta.get("lastFullSync") is not None:
+            self.lastFullSync = float(meta["lastFullSync"])
+        if meta.get("lastSyncedAt") is not None:
+            self.lastSyncedAt = float(meta["lastSyncedAt"])
+        return len(self.tasksByID)
+
+    # Description: Check if there is data to serve, either synced since the
+    #              bot started or loaded from the task store
+    def isLoaded(self):
+        return self.lastSyncedAt is not None
+
+    # Description: Get monitoring information about the snapshot
+    def stats(self):
+        return {
+            "pages": len(self.tasksByID),
+            "staleness": self.staleness(),
+            "lastSyncDuration": self.lastSyncDuration,
+            "lastSyncChanged": self.lastSyncChanged,
+            "backgroundSync": self.backgroundSync,
+            "warmStart": self.isWarmStart()
+        }
+
+    # Description: Sync before a read if the snapshot has never been
+    #              synced, or expired without a background loop keeping it
+    #              warm. A snapshot loaded from the task store is served
+    #              right away while the background loop syncs it
+    async def ensureFresh(self):
+        if self.lastSyncedAt is None or (self.isStale()
+                                         and not self.backgroundSync):
+            botMetrics.cacheLookups.labels("miss").inc()
+            await self.sync()
+        else:
+            botMetrics.cacheLookups.labels("hit").inc()
+
+    # Description: Download the tags and every page from Notion
+    # @param priority: INTERACTIVE when a command is waiting on the refresh
+    # @return: number of pages that were added, edited or removed
+    async def refresh(self, priority=INTERACTIVE):
+        self.lastSyncKind = "full"
+        await self.refreshTags(priority)
+        pages = await notionDB.queryDatabase(priority)
+
+        # only the pages that changed since the last sync are saved
+        newIDs = set(page["id"] for page in pages)
+        removedIDs = [id for id in self.tasksByID if id not in newIDs]
+        edited = [page for page in pages if self.isEdited(page)]
+        await self.saveChanges(edited, removedIDs)
+
+        self.syncCursor = newestEdit(pages, None)
+        await asyncio.to_thread(taskStore.setMeta, "syncCursor",
+                                self.syncCursor)
+        self.lastRefresh = time.monotonic()
+        # wall clock time, so it is still meaningful after a restart
+        self.lastFullSync = time.time()
+        await asyncio.to_thread(taskStore.setMeta, "lastFullSync",
+                                self.lastFullSync)
+        return len(edited) + len(removedIDs)
+
+    # Description: Download the tags from Notion
+    async def refreshTags(self, priority=INTERACTIVE):
+        data = await notionDB.readDatabase(priority)
+        await self.setTags(notionDB.updateTags(data))
+
+    # Description: Bring the snapshot up to date. A sync that is already
+    #              running is shared instead of starting another one
+    # @param priority: INTERACTIVE when a command is waiting on the sync
+    # @return: number of pages that were added, edited or removed
+    async def sync(self, priority=INTERACTIVE):
+        return await notionDB.singleFlight("sync",
+                                           lambda: self.runSync(priority))
+
+    # Description: Sync the snapshot and record how long it took
+    async def runSync(self, priority):
+        start = time.monotonic()
+        changed = await self.syncPages(priority)
+        self.lastSyncDuration = time.monotonic() - start
+        self.lastSyncChanged = changed
+        botMetrics.syncDuration.labels(self.lastSyncKind).observe(
+            self.lastSyncDuration)
+        self.lastSyncedAt = time.time()
+        await asyncio.to_thread(taskStore.setMeta, "lastSyncedAt",
+                                self.lastSyncedAt)
+        return changed
+
+    # Description: Only the pages edited since the last sync are
+    #              downloaded, with a full refresh every
+    #              FULL_SYNC_INTERVAL seconds
+    # @return: number of pages that were added, edited or removed
+    async def syncPages(self, priority):
+        if (self.syncCursor is None or self.lastFullSync is None
+                or time.time() - self.lastFullSync > FULL_SYNC_INTERVAL):
+            return await self.refresh(priority)
+
+        self.lastSyncKind = "incremental"
+        await self.refreshTags(priority)
+
+        pages = []
+        query = notionDB.buildEditedSinceQuery(self.syncCursor)
+        async for page in notionDB.iterPages(query, priority):
+            pages.append(page)
+        # pages edited at the cursor are returned again by every sync
+        edited = [page for page in pages if self.isEdited(page)]
+        await self.saveChanges(edited, [])
+        # only advanced once every edited page has been read, so an edit
+        # is never skipped
+        self.syncCursor = newestEdit(pages, self.syncCursor)
+        await asyncio.to_thread(taskStore.setMeta, "syncCursor",
+                                self.syncCursor)
+
+        self.lastRefresh = time.monotonic()
+        return len(edited)
+
+    ############
+    # INDEXING #
+    ############
+
+    # Description: Check if a page was edited since its task was indexed
+    def isEdited(self, page):
+        old = self.tasksByID.get(page["id"])
+        return old is None or old.lastEdited != page["last_edited_time"]
+
+    # Description: Save the pages a sync added or edited and drop the
+    #              removed ones in the task store off the event loop, then
+    #              update the indexes. Tasks are saved first, since the
+    #              task listeners (i.e. reminders) save rows that refer to
+    #              them
+    # @param pages: page objects from Notion that were added or edited
+    # @param removedIDs: IDs of the pages that are no longer in Notion
+    async def saveChanges(self, pages, removedIDs):
+        tasks = [taskModel.taskFromPage(page) for page in pages]
+        await asyncio.to_thread(taskStore.updateTasks, tasks, removedIDs)
+        for pageID in removedIDs:
+            # a webhook event may have removed it while it was saved
+            old = self.tasksByID.pop(pageID, None)
+            if old is not None:
+                self.unindexTask(old)
+        for task in tasks:
+            self.indexTask(task)
+
+    # Description: Replace every task and rebuild the task indexes
+    def setTasks(self, tasks):
+        self.tasksByID = {}
+        self.nameIndex = {}
+        self.nameTasks = {}
+        self.tagTasks = [{} for key in TAG_KEYS]
+        self.dueIndex = []
+        self.sortedNames = []
+        self.wordNames = {}
+        self.trigramIndex = {}
+        self.wordTrigrams = {}
+        self.wordCountNames = {}
+        for task in tasks:
+            self.indexTask(task)
+
+    # Description: Add or replace a single page. Its task is upserted in the
+    #              task store off the event loop before it is indexed
+    # @param page: page object from Notion
+    # @return: the Task stored for the page
+    async def applyPage(self, page):
+        task = taskModel.taskFromPage(page)
+        await asyncio.to_thread(taskStore.upsertTasks, [task])
+        self.indexTask(task)
+        return task
+
+    # Description: Add or replace a single task in the task indexes
+    def indexTask(self, task):
+        old = self.tasksByID.get(task.id)
+        if old is not None:
+            self.unindexTask(old)
+        self.tasksByID[task.id] = task
+        name = task.name.lower()
+        if name not in self.nameIndex:
+            bisect.insort(self.sortedNames, name)
+            self.wordCountNames.setdefault(len(name.split()), set()).add(name)
+            for word in set(name.split()):
+                if word not in self.wordNames:
+                    self.wordNames[word] = set()
+                    self.wordTrigrams[word] = trigrams(word)
+                    for trigram in self.wordTrigrams[word]:
+                        self.trigramIndex.setdefault(trigram, set()).add(word)
+                self.wordNames[word].add(name)
+        self.nameTasks.setdefault(name, set()).add(task.id)
+        self.nameIndex[name] = task
+        for category, tags in enumerate(
+                [task.assignedTo, task.assignedBy, task.taskType]):
+            for tag in tags:
+                self.tagTasks[category].setdefault(tag, set()).add(task.id)
+        if task.due is not None:
+            bisect.insort(self.dueIndex, (taskModel.dueKey(task.due), task.id))
+        for listener in self.taskListeners:
+            listener(task)
+
+    # Description: Remove a task from the name, tag and due date indexes
+    def unindexTask(self, task):
+        name = task.name.lower()
+        ids = self.nameTasks[name]
+        ids.discard(task.id)
+        if len(ids) > 0:
+            # another task with the same name keeps the name's entries
+            if self.nameIndex[name] is task:
+                self.nameIndex[name] = self.tasksByID[next(iter(ids))]
+        else:
+            del self.nameTasks[name]
+            del self.nameIndex[name]
+            i = bisect.bisect_left(self.sortedNames, name)
+            if i < len(self.sortedNames) and self.sortedNames[i] == name:
+                del self.sortedNames[i]
+            names = self.wordCountNames[len(name.split())]
+            names.discard(name)
+            if len(names) == 0:
+                del self.wordCountNames[len(name.split())]
+            for word in set(name.split()):
+                names = self.wordNames[word]
+                names.discard(name)
+                if len(names) > 0:
+                    continue
+                del self.wordNames[word]
+                for trigram in self.wordTrigrams.pop(word):
+                    words = self.trigramIndex[trigram]
+                    words.discard(word)
+                    if len(words) == 0:
+                        del self.trigramIndex[trigram]
+        for category, tags in enumerate(
+                [task.assignedTo, task.assignedBy, task.taskType]):
+            for tag in tags:
+                ids = self.tagTasks[category].get(tag)
+                if ids is not None:
+                    ids.discard(task.id)
+                    if len(ids) == 0:
+                        del self.tagTasks[category][tag]
+        if task.due is not None:
+            entry = (taskModel.dueKey(task.due), task.id)
+            i = bisect.bisect_left(self.dueIndex, entry)
+            if i < len(self.dueIndex) and self.dueIndex[i] == entry:
+                del self.dueIndex[i]
+
+    # Description: Remove a single page from the task indexes and the store
+    async def removePage(self, pageID):
+        old = self.tasksByID.pop(pageID, None)
+        if old is not None:
+            self.unindexTask(old)
+        await asyncio.to_thread(taskStore.deleteTask, pageID)
+
+    # Description: Replace the tags, rebuild the tag indexes and save the
+    #              tags in the task store
+    async def setTags(self, tags):
+        if tags != self.tags:
+            await asyncio.to_thread(taskStore.saveTags, tags)
+        self.tags = tags
+        for i in range(0, len(TAG_KEYS)):
+            self.tagIndex[i] = {
+                tag["name"].casefold(): tag["name"]
+                for tag in tags[i][TAG_KEYS[i]]
+            }
+
+    ###########
+    # LOOKUPS #
+    ###########
+
+    # Description: Get the tags in the updateTags format, syncing if needed
+    async def getTags(self):
+        await self.ensureFresh()
+        return self.tags
+
+    # Description: Find a task by its name (case insensitive)
+    # @return: the Task, or None if the name does not exist
+    async def findTask(self, taskName):
+        await self.ensureFresh()
+        return self.nameIndex.get(taskName.lower())
+
+    # Description: Find the tasks that match every given filter, using the
+    #              tag and due date indexes. A task matches a list of tags
+    #              if it has any of them
+    # @param tags: [assignedTo, assignedBy, taskType] lists of tag names,
+    #              an empty list matches every task
+    # @param completion: True/False to match the Completion checkbox, None
+    #                    for both
+    # @param dueAfter: datetime, only tasks due on or after it match
+    # @param dueBefore: datetime, only tasks due on or before it match
+    # @param text: case insensitive text the description must contain
+    # @return: list of Tasks sorted by due date, tasks without a date last
+    async def findTasks(self, tags=([], [], []), completion=None,
+                        dueAfter=None, dueBefore=None, text=None):
+        await self.ensureFresh()
+
+        ids = None
+        for category in range(0, len(TAG_KEYS)):
+            if len(tags[category]) == 0:
+                continue
+            matched = set()
+            for tag in tags[category]:
+                matched |= self.tagTasks[category].get(tag, set())
+            ids = matched if ids is None else ids & matched
+
+        if dueAfter is not None or dueBefore is not None:
+            # slice of the due date index, already in date order
+            low = 0
+            high = len(self.dueIndex)
+            if dueAfter is not None:
+                low = bisect.bisect_left(self.dueIndex,
+                                         (taskModel.dueKey(dueAfter), ""))
+            if dueBefore is not None:
+                high = bisect.bisect_right(
+                    self.dueIndex, (taskModel.dueKey(dueBefore), "\uffff"))
+            tasks = [
+                self.tasksByID[id] for due, id in self.dueIndex[low:high]
+                if ids is None or id in ids
+            ]
+        else:
+            if ids is None:
+                tasks = list(self.tasksByID.values())
+            else:
+                tasks = [self.tasksByID[id] for id in ids]
+            tasks.sort(key=lambda task: (task.due is None, dt.datetime.min
+                                         if task.due is None else
+                                         taskModel.dueKey(task.due)))
+
+        if completion is not None:
+            tasks = [task for task in tasks if task.completion == completion]
+        if text:
+            text = text.casefold()
+            tasks = [task for task in tasks
+                     if text in task.description.casefold()]
+        return tasks
+
+    # Description: Suggest task names that are spelled like the given name,
+    #              for "did you mean" messages. Each typed word is matched to
+    #              the words of the names, so a typo of one word of a long
+    #              name is found. Reads the snapshot as it is, without
+    #              syncing
+    # @param limit: most names returned
+    # @return: task names, most similar first
+    def suggestNames(self, taskName, limit=3):
+        words = taskName.lower().split()
+        matches = [self.similarWords(word) for word in words]
+        pools = [
+            set().union(*[self.wordNames[word] for word in match])
+            for match in matches if len(match) > 0
+        ]
+        if len(pools) == 0:
+            return []
+
+        # names with a match for every typed word, or for the rarest one
+        # if there are none
+        pools.sort(key=len)
+        candidates = pools[0].intersection(*pools[1:])
+        if len(candidates) == 0:
+            candidates = pools[0]
+        if len(candidates) > MAX_SUGGEST_CANDIDATES:
+            candidates = self.fewestExtraWords(candidates, len(words),
+                                               max(MAX_SUGGEST_CANDIDATES,
+                                                   limit))
+
+        scored = []
+        for name in candidates:
+            nameWords = name.split()
+            # average over the typed words of their best match in the name
+            score = sum(
+                max(map(match.get, nameWords, itertools.repeat(0)))
+                for match in matches) / len(words)
+            if score < SUGGEST_THRESHOLD:
+                continue
+            # ties go to names with as many words as typed, then to names
+            # with the words in the typed order
+            inOrder = sum(word in match
+                          for word, match in zip(nameWords, matches))
+            scored.append((-score, abs(len(nameWords) - len(words)), -inOrder,
+                           len(name), name))
+        scored.sort()
+        return [self.nameIndex[entry[-1]].name for entry in scored[:limit]]
+
+    # Description: Pick the names whose number of words is closest to the
+    #              number of words typed
+    # @param names: set of lowercase names
+    # @param count: number of words typed
+    # @param limit: most names returned
+    # @return: list of lowercase names
+    def fewestExtraWords(self, names, count, limit):
+        picked = []
+        for wordCount in sorted(self.wordCountNames,
+                                key=lambda n: (abs(n - count), n)):
+            picked.extend(names & self.wordCountNames[wordCount])
+            if len(picked) >= limit:
+                break
+        return picked[:limit]
+
+    # Description: Find the words of the task names spelled like a word
+    # @return: dictionary of word -> trigram similarity (0 to 1)
+    def similarWords(self, word):
+        query = trigrams(word)
+        # number of query trigrams in each word that shares any
+        shared = collections.Counter()
+        for trigram in query:
+            words = self.trigramIndex.get(trigram)
+            if words is not None:
+                shared.update(words)
+
+        similar = {}
+        for other, count in shared.items():
+            score = 2 * count / (len(query) + len(self.wordTrigrams[other]))
+            if score >= SUGGEST_THRESHOLD:
+                similar[other] = score
+        return similar
+
+    # Description: Complete a partly typed task name. Names that start with
+    #              the text, or names spelled like it if none do
+    # @param limit: most names returned
+    # @return: task names
+    def completeNames(self, text, limit=25):
+        text = text.lower()
+        names = []
+        i = bisect.bisect_left(self.sortedNames, text)
+        while (i < len(self.sortedNames) and len(names) < limit
+               and self.sortedNames[i].startswith(text)):
+            names.append(self.nameIndex[self.sortedNames[i]].name)
+            i += 1
+        if len(names) == 0 and len(text) >= 3:
+            names = self.suggestNames(text, limit)
+        return names
+
+    # Description: Get the casefolded tag -> canonical tag name index. A
+    #              snapshot that was never synced only downloads the tags
+    # @param listNum: [{0: assignTo}, {1: assignBy}, {2: taskType}]
+    async def getTagIndex(self, listNum):
+        if self.isLoaded():
+            await self.ensureFresh()
+        else:
+            await self.refreshTags()
+        return self.tagIndex[listNum]
+
+
+# Description: Get the newest last_edited_time of a list of pages
+# @param cursor: returned if it is newer or there are no pages
+def newestEdit(pages, cursor):
+    for page in pages:
+        edited = page.get("last_edited_time")
+        if edited is not None and (cursor is None or edited > cursor):
+            cursor = edited
+    return cursor
+
+
+# Description: Get the trigrams of a lowercase word. The word is padded so
+# 			   its start and short words also have trigrams
+def trigrams(word):
+    padded = "  " + word + " "
+    return set(padded[i:i + 3] for i in range(0, len(padded) - 2))
+
+
+# snapshot shared by the whole bot
+snapshot = Snapshot()
+botMetrics.snapshotPages.set_function(lambda: len(snapshot.tasksByID))
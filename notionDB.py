@@ -1,6 +1,14 @@
-import requests
+import aiohttp
+import asyncio
 import json
 import os
+import time
+
+import botMetrics
+import notionCache
+import notionScheduler
+import taskModel
+from notionScheduler import INTERACTIVE
 
 #############
 # CONSTANTS #
@@ -12,50 +20,180 @@ headers = {
     "Notion-Version": "2022-06-28"
 }
 
+# set to a fakeNotion server to run without the real API
+NOTION_URL = os.getenv("NOTION_URL", "https://api.notion.com/v1")
+
+# 100 is the largest page size Notion allows per request
 payload = {"page_size": 100}
 
+# maximum number of open connections to Notion
+POOL_SIZE = int(os.getenv("NOTION_POOL_SIZE", "10"))
+# seconds an idle connection is kept open for reuse
+KEEPALIVE_TIMEOUT = float(os.getenv("NOTION_KEEPALIVE_TIMEOUT", "60"))
+
+# Notion allows an average of 3 requests per second
+RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))
+RATE_BURST = float(os.getenv("NOTION_RATE_BURST", "3"))
+# number of times a request is retried after a 429, 5xx or network error
+MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "4"))
+
+####################
+# GLOBAL VARIABLES #
+####################
+
+# long-lived session shared by every request to Notion
+session = None
+
+# every request to Notion waits on this token bucket
+limiter = notionScheduler.RateLimiter(RATE_LIMIT, RATE_BURST)
+
+# key -> future of a call that is in flight, see singleFlight
+inFlight = {}
+
+
+# Raised when Notion does not answer a read, so callers never mistake a
+# partial read for the whole database
+class NotionError(Exception):
+    pass
+
 ####################
 # HELPER FUNCTIONS #
 ####################
 
 # Return the page ID given the task name
 # Guaranteed that task name exists
-def getPageID(taskName):
-	with open("./pages.json") as f:
-		pages = json.load(f)
-	
-	for page in pages:
-		if page["properties"]["Task"]["title"][0]["text"]["content"].lower() == taskName.lower():
-			return page["id"]
+async def getPageID(taskName):
+    task = await notionCache.snapshot.findTask(taskName)
+    return task.id
+
+
+# Remove the keys of a page object that the bot does not use.
+# last_edited_time is kept for incremental syncs
+# return: the same page object
+def cleanPage(page):
+    for key in ["created_time", "last_edited_by", "created_by", "cover",
+                "icon"]:
+        page.pop(key, None)
+    return page
+
+
+# Run a call once for every caller that asks for the same key while it is
+# in flight. Later callers wait on the first call and get the same result
+# key: name of the resource being read
+# function: coroutine function that makes the call
+# return: the result of the call
+async def singleFlight(key, function):
+    future = inFlight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(function())
+        inFlight[key] = future
+        future.add_done_callback(lambda done: inFlight.pop(key, None)
+                                 if inFlight.get(key) is done else None)
+    # a cancelled caller must not cancel the call for everyone else
+    return await asyncio.shield(future)
+
+
+# Get the shared session, opening it on first use. Connections are pooled
+# and kept alive so requests skip the TCP and TLS handshakes
+def getSession():
+    global session
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT)
+        session = aiohttp.ClientSession(headers=headers, connector=connector)
+    return session
+
+
+# Close the shared session. Called when the bot shuts down
+async def closeSession():
+    global session
+    if session is not None:
+        await session.close()
+        session = None
+
+
+# Send a request to Notion without blocking the event loop. Requests wait
+# for the rate limiter and are retried with backoff on 429, 5xx and
+# network errors, honouring Retry-After
+# priority: INTERACTIVE for commands, BACKGROUND for refreshes
+# repeatable: False for requests that must not run twice (i.e. creating a
+#             page). They are only retried on 429 and when the connection
+#             failed before the request was sent
+# return: (status code, parsed json body or None if it is not json)
+async def sendRequest(method, url, body=None, priority=INTERACTIVE,
+                      repeatable=True):
+    attempt = 0
+    while True:
+        await limiter.acquire(priority)
+        start = time.perf_counter()
+        try:
+            async with getSession().request(method, url,
+                                            json=body) as response:
+                status = response.status
+                text = await response.text(errors="replace")
+                retryAfter = response.headers.get("Retry-After")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            botMetrics.observeRequest(method, url, NOTION_URL, None,
+                                      time.perf_counter() - start)
+            # other errors can happen after Notion received the request
+            notSent = isinstance(e, aiohttp.ClientConnectorError)
+            if attempt >= MAX_RETRIES or not (repeatable or notSent):
+                raise
+            status, data, retryAfter = None, None, None
+        else:
+            botMetrics.observeRequest(method, url, NOTION_URL, status,
+                                      time.perf_counter() - start)
+            # gateways answer 502 and 504 with HTML, which is retried
+            # like any other 5xx instead of failing to parse
+            try:
+                data = json.loads(text)
+            except ValueError:
+                data = None
+
+        if status is not None and status != 429 and (status < 500
+                                                     or not repeatable):
+            return status, data
+        if attempt >= MAX_RETRIES:
+            print("Notion request failed after retries:", method, url, status)
+            return status, data
+
+        delay = notionScheduler.backoff(attempt, retryAfter)
+        if status == 429:
+            # every request waits, not only this one
+            limiter.pause(delay)
+        print("Notion request retrying in {0:.1f}s:".format(delay), status)
+        await asyncio.sleep(delay)
+        attempt += 1
 
 
 ############################
 # NOTION MANAGER FUNCTIONS #
 ############################
 
-	
+
 # Get primary information about the database
 # header: headers for get request
-def readDatabase():
-    url = "https://api.notion.com/v1/databases/{0}".format(
-        os.getenv("DATABASE_ID"))
+# return: the database information as a dictionary
+# raises: NotionError if Notion did not return it
+async def readDatabase(priority=INTERACTIVE):
+    return await singleFlight("database", lambda: fetchDatabase(priority))
+
+
+async def fetchDatabase(priority):
+    url = "{0}/databases/{1}".format(NOTION_URL, os.getenv("DATABASE_ID"))
 
-    response = requests.get(url, headers=headers)
-    if (response.status_code == 200):
+    status, data = await sendRequest("GET", url, priority=priority)
+    if (status == 200):
         print("Notion database connected")
     else:
-        print("Notion database not connected")
-    # store the database information in db.json
-    data = json.loads(response.text)
-    with open("./db.json", "w", encoding="utf8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        raise NotionError("Notion database not connected: {0}".format(status))
 
-    updateTags(data)
-    queryDatabase()
+    return data
 
 
 # Get and update the tags for the database
-# data: string with json data from db.json
+# data: the database information from readDatabase
+# return: the tags as [{"assignToIDs": []}, {"assignByIDs": []}, {"typeIDs": []}]
 def updateTags(data):
 
     assignToIDs = []
@@ -84,14 +222,14 @@ def updateTags(data):
         "typeIDs": typeIDs
     }]
 
-    # save tags in tags.json
-    with open("./tags.json", "w", encoding="utf8") as f:
-        json.dump(tags, f, ensure_ascii=False, indent=4)
+    return tags
 
 
-def createPage(task, description, dueDate, assignedTo, assignedBy, taskType):
-    readDatabase()
-    url = "https://api.notion.com/v1/pages"
+# Create a new page in the database
+# return: the new Task, or None if Notion did not accept it
+async def createPage(task, description, dueDate, assignedTo, assignedBy,
+                     taskType):
+    url = "{0}/pages".format(NOTION_URL)
 
     newPageData = {
         "parent": {
@@ -130,162 +268,262 @@ def createPage(task, description, dueDate, assignedTo, assignedBy, taskType):
         }
     }
 
-    data = json.dumps(newPageData)
-    res = requests.post(url, headers=headers, data=data)
-    print("New task status code:", res.status_code)
-    return res.status_code
-
-
-# Find the page ID given the task name
-# Task name must be unique, otherwise, the first task in the list will be given
-def getPage(taskName):
-    queryDatabase()
-    pageInfo = {}
-    with open("./pages.json") as f:
-        pages = json.load(f)
-
-    # find page id given page name
-    for page in pages:
-	    if page["properties"]["Task"]["title"][0]["text"]["content"].lower() == taskName.lower():
-		    desc = page["properties"]["Description"]["rich_text"][0]["text"]["content"]
-		    completion = page["properties"]["Completion"]["checkbox"]
-		    dateTime = page["properties"]["Date"]["date"]["start"]
-		    assignedTo = [tag["name"] for tag in page["properties"]["Assigned to"]["multi_select"]]
-		    assignedBy = [tag["name"] for tag in page["properties"]["Assigned by"]["multi_select"]]
-		    taskType = [tag["name"] for tag in page["properties"]["Type"]["multi_select"]]
-		    url = page["url"]
-		    id = page["id"]
-			
-		    pageInfo.update({"name": taskName}) 
-		    pageInfo.update({"description": desc})
-		    pageInfo.update({"completion": completion})
-		    pageInfo.update({"dateTime": dateTime})
-		    pageInfo.update({"assignedTo": assignedTo})
-		    pageInfo.update({"assignedBy": assignedBy})
-		    pageInfo.update({"taskType": taskType})
-		    pageInfo.update({"url": url})
-		    pageInfo.update({"pageID": id})
-    
-    # print(pageInfo)		
-    return pageInfo
-
-
-
-# limited to 100 pages
-def queryDatabase():
-    url = "https://api.notion.com/v1/databases/{0}/query".format(
-        os.getenv("DATABASE_ID"))
-
-    response = requests.post(url, json=payload, headers=headers)
-    # print(response.text)
-
-    jsonFile = json.loads(response.text)["results"]
-    # filter unnessary keys
-    for object in jsonFile:
-        del object["created_time"]
-        del object["last_edited_time"]
-        del object["last_edited_by"]
-        del object["created_by"]
-        del object["cover"]
-        del object["icon"]
-
-        # store pages details into pages.json
-    with open("./pages.json", "w", encoding="utf8") as f:
-        json.dump(jsonFile, f, ensure_ascii=False, indent=4)
+    # a retry after Notion made the page would post the task twice
+    status, data = await sendRequest("POST", url, newPageData,
+                                     repeatable=False)
+    print("New task status code:", status)
+    if status != 200:
+        return None
+
+    # Notion returns the new page, so the snapshot is updated without a sync
+    return await notionCache.snapshot.applyPage(cleanPage(data))
+
+
+# Read a single page given its page ID
+# return: the page, or None if Notion did not return it
+async def fetchPage(id, priority=INTERACTIVE):
+    url = "{0}/pages/{1}".format(NOTION_URL, id)
+
+    status, data = await sendRequest("GET", url, priority=priority)
+    if status != 200:
+        print("Could not read page", id, status)
+        return None
+    return cleanPage(data)
+
+
+# Find a task given the task name
+# return: the Task, or None if the name does not exist
+async def getPage(taskName):
+    return await notionCache.snapshot.findTask(taskName)
+
+
+# Stream the pages of the database, following next_cursor until every page
+# has been read. Only one batch of pages is held at a time, so callers
+# can stop early (i.e. when a name lookup finds a match)
+# query: extra fields for the query body (filter, sorts)
+# priority: INTERACTIVE for commands, BACKGROUND for refreshes
+# return: async generator of pages
+# raises: NotionError if a batch could not be read
+async def iterPages(query=None, priority=INTERACTIVE):
+    url = "{0}/databases/{1}/query".format(NOTION_URL,
+                                           os.getenv("DATABASE_ID"))
+    body = dict(payload)
+    if query is not None:
+        body.update(query)
+
+    while True:
+        status, data = await sendRequest("POST", url, body, priority)
+        if status != 200:
+            raise NotionError("Notion query failed: {0}".format(status))
+
+        for object in data["results"]:
+            # filter unnessary keys
+            yield cleanPage(object)
+
+        if not data["has_more"]:
+            return
+        body["start_cursor"] = data["next_cursor"]
+
+
+# Build a query body for the pages edited since the last sync, newest first
+# since: ISO 8601 last_edited_time of the newest page already seen
+# return: query body for iterPages
+def buildEditedSinceQuery(since):
+    return {
+        "filter": {
+            "timestamp": "last_edited_time",
+            "last_edited_time": {"on_or_after": since}
+        },
+        "sorts": [{
+            "timestamp": "last_edited_time",
+            "direction": "descending"
+        }]
+    }
+
+
+# Build a query body that filters and sorts the database on Notion's side.
+# Used before the snapshot is first synced, so only the matching pages are
+# downloaded
+# assignedTo: list of tag names, a page matches if it has any of them
+# completion: True/False to match the Completion checkbox, None for both
+# dueAfter/dueBefore: ISO 8601 dates bounding the Date property
+# return: query body for iterPages
+def buildQuery(assignedTo=None, completion=None, dueAfter=None,
+               dueBefore=None):
+    filters = []
+
+    if assignedTo:
+        tagFilters = [{
+            "property": "Assigned to",
+            "multi_select": {"contains": tag}
+        } for tag in assignedTo]
+        if len(tagFilters) == 1:
+            filters.append(tagFilters[0])
+        else:
+            filters.append({"or": tagFilters})
+
+    if completion is not None:
+        filters.append({
+            "property": "Completion",
+            "checkbox": {"equals": completion}
+        })
+
+    if dueAfter is not None:
+        filters.append({
+            "property": "Date",
+            "date": {"on_or_after": dueAfter}
+        })
+
+    if dueBefore is not None:
+        filters.append({
+            "property": "Date",
+            "date": {"on_or_before": dueBefore}
+        })
+
+    query = {"sorts": [{"property": "Date", "direction": "ascending"}]}
+    if len(filters) == 1:
+        query["filter"] = filters[0]
+    elif len(filters) > 1:
+        query["filter"] = {"and": filters}
+
+    return query
+
+
+# Read every page that matches a query
+# query: extra fields for the query body (filter, sorts)
+# return: list of pages
+async def collectPages(query, priority):
+    return [page async for page in iterPages(query, priority)]
+
+
+# Read every page in the database
+# return: list of pages in the database
+async def queryDatabase(priority=INTERACTIVE):
+    return await singleFlight("database query",
+                              lambda: fetchAllPages(priority))
+
+
+async def fetchAllPages(priority):
+    return await collectPages(None, priority)
+
+
+# Build the properties that update a specific field of a page
+# field is enumerated such that:
+#	{1: Task}, {2: Description}, {3: Date}, {4: Assigned To},
+#	{5: Assigned By}, {6: Type}, {7: Completion}
+# return: the "properties" of a PATCH body
+def buildProperties(field, data):
+    # properties for the field
+    updateData = None
+    if field == 1: # update title
+        updateData = {
+            "properties": {
+                "Task": {
+                    "title": [{
+                        "text": {"content": data}
+                    }]
+                }
+            }
+        }
+    elif field == 2: # update description
+        updateData = {
+            "properties": {
+                "Description": {
+                    "rich_text": [{
+                        "type": "text",
+                        "text": {"content": data}
+                    }]
+                }
+            }
+        }
+    elif field == 3: # update date
+        updateData = {
+            "properties": {
+                "Date": {
+                    "date": {"start": data}
+                }
+            }
+        }
+    elif field == 4: # update assign to tags
+        updateData = {
+            "properties": {
+                "Assigned to": {"multi_select": data}
+            }
+        }
+    elif field == 5: # update assign by tags
+        updateData = {
+            "properties": {
+                "Assigned by": {"multi_select": data}
+            }
+        }
+    elif field == 6: # update type tags
+        updateData = {
+            "properties": {
+                "Type": {"multi_select": data}
+            }
+        }
+    elif field == 7: # update completion checkbox
+        updateData = {
+            "properties": {
+                "Completion": {
+                    "checkbox": data
+                }
+            }
+        }
+
+    return updateData["properties"]
 
 
 # get a page and update a specific field
 # task name is guaranteed to exist
-# field is enumerated such that: 
+# field is enumerated such that:
 #	{1: Task}, {2: Description}, {3: Date}, {4: Assigned To},
 #	{5: Assigned By}, {6: Type}, {7: Completion}
+# return: the updated Task, or None if Notion did not accept it
+async def updatePage(taskName, field, data):
+    #get page ID
+    id = await getPageID(taskName)
+    return await updatePageProperties(id, buildProperties(field, data))
+
+
+# Update several properties of a page in a single request
+# properties: merged results of buildProperties
+# return: the updated Task, or None if Notion did not accept it
+async def updatePageProperties(id, properties):
+    url = "{0}/pages/{1}".format(NOTION_URL, id)
 
-		
-def updatePage(taskName, field, data):
-	#get page ID
-	queryDatabase()
-	id = getPageID(taskName)
-	url = "https://api.notion.com/v1/pages/{0}".format(id)
-
-	# update file info
-	updateData = None
-	if field == 1: # update title
-		updateData = {
-			"properties": {
-            	"Task": {
-                	"title": [{
-                    	"text": {"content": data}
-                	}]
-				}
-			}
-		}
-	elif field == 2: # update description
-		updateData = {
-			"properties": {
-				"Description": {
-                	"rich_text": [{
-                    	"type": "text",
-                    	"text": {"content": data}
-                	}]
-            	}
-			}
-		}
-	elif field == 3: # update date
-		updateData = {
-			"properties": {
-				"Date": {
-                	"date": {"start": data}
-            	}
-			}
-		}
-	elif field == 4: # update assign to tags
-		updateData = {
-			"properties": {
-				"Assigned to": {"multi_select": data}
-			}
-		}
-	elif field == 5: # update assign by tags
-		updateData = {
-			"properties": {
-				"Assigned by": {"multi_select": data}
-			}
-		}
-	elif field == 6: # update type tags
-		updateData = {
-			"properties": {
-				"Type": {"multi_select": data}
-			}
-		}
-	elif field == 7: # update completion checkbox
-		updateData = {
-			"properties": {
-				"Completion": {
-					"checkbox": data
-				}
-			}
-		}
-
-	jsonData = json.dumps(updateData)
-	response = requests.patch(url, headers=headers, data=jsonData)
-	
-	# print(response.status_code)
-	return response.status_code
+    updateData = {"properties": properties}
+    status, response = await sendRequest("PATCH", url, updateData)
+    # print(status)
+    if status != 200:
+        return None
+
+    # Notion returns the updated page, so the snapshot is updated in place
+    return await notionCache.snapshot.applyPage(cleanPage(response))
 
 
 # Delete a page given the task name
 # task name is guaranteed to exist
-def deletePage(taskName):
-	queryDatabase()
-	id = getPageID(taskName)
-	url = "https://api.notion.com/v1/pages/{0}".format(id)
-	
-	updateData = {"archived": True}
-
-	jsonData = json.dumps(updateData)
-	response = requests.patch(url, headers=headers, data=jsonData)
-	
-	# print(response.status_code)
-	return response.status_code
+# return: the archived Task, or None if Notion did not accept it
+async def deletePage(taskName):
+    return await archivePage(await getPageID(taskName))
+
+
+# Archive a page given its page ID
+# return: the archived Task, or None if Notion did not accept it
+async def archivePage(id):
+    url = "{0}/pages/{1}".format(NOTION_URL, id)
+
+    updateData = {"archived": True}
+
+    status, response = await sendRequest("PATCH", url, updateData)
+    # print(status)
+    if status != 200:
+        return None
+
+    # archived pages are not returned by incremental syncs
+    await notionCache.snapshot.removePage(id)
+    return taskModel.taskFromPage(response)
 
 # readDatabase()
 # deletePage("test task")
@@ -0,0 +1,93 @@
+###
+# notionEvents.py
+#
+# Description: Apply Notion webhook events (pages created, updated or
+#              archived in the Notion UI) to the snapshot without polling.
+#              The keep alive server queues events as they arrive, and
+#              they are handled one at a time on the bot's event loop.
+###
+
+import asyncio
+import os
+
+import notionCache
+import notionDB
+from notionScheduler import BACKGROUND
+
+#############
+# CONSTANTS #
+#############
+
+# events where the page is read again and applied to the snapshot
+UPDATE_EVENTS = [
+    "page.created", "page.properties_updated", "page.content_updated",
+    "page.undeleted", "page.moved"
+]
+# events where the page is removed from the snapshot
+DELETE_EVENTS = ["page.deleted"]
+
+####################
+# GLOBAL VARIABLES #
+####################
+
+# the bot's event loop and the queue of events waiting to be handled
+eventLoop = None
+eventQueue = None
+consumer = None
+
+
+# Description: Start handling events on the running event loop
+def start():
+    global eventLoop, eventQueue, consumer
+    eventLoop = asyncio.get_running_loop()
+    eventQueue = asyncio.Queue()
+    consumer = asyncio.create_task(consumeEvents())
+
+
+# Description: Hand an event to the bot's event loop. Safe to call from
+# 			   any thread
+# @return: False if the bot is not ready to handle events
+def pushEvent(event):
+    if eventLoop is None or eventLoop.is_closed():
+        return False
+    eventLoop.call_soon_threadsafe(eventQueue.put_nowait, event)
+    return True
+
+
+# Description: Handle events one at a time as they arrive
+async def consumeEvents():
+    while True:
+        event = await eventQueue.get()
+        try:
+            await handleEvent(event)
+        except Exception as e:
+            print("Could not handle Notion event:", repr(e))
+
+
+# Description: Check that a page belongs to the bot's database
+def inDatabase(page):
+    parent = page.get("parent", {})
+    databaseID = parent.get("database_id") or ""
+    return (databaseID.replace("-", "") ==
+            os.getenv("DATABASE_ID", "").replace("-", ""))
+
+
+# Description: Apply a single event to the snapshot
+# @param event: webhook payload with "type" and "entity"
+async def handleEvent(event):
+    entity = event.get("entity", {})
+    if entity.get("type") != "page":
+        return
+    pageID = entity["id"]
+
+    if event.get("type") in DELETE_EVENTS:
+        await notionCache.snapshot.removePage(pageID)
+    elif event.get("type") in UPDATE_EVENTS:
+        # events only carry the page ID, so the page is read again
+        page = await notionDB.fetchPage(pageID, BACKGROUND)
+        if page is None or not inDatabase(page):
+            return
+        if page.get("archived") or page.get("in_trash"):
+            await notionCache.snapshot.removePage(pageID)
+        else:
+            await notionCache.snapshot.applyPage(page)
@@ -0,0 +1,58 @@
+###
+# notionRefresh.py
+#
+# Description: Background loop that keeps the Notion snapshot warm so
+#              commands are served from the cache immediately. The loop
+#              backs off while nothing changes in Notion.
+###
+
+import os
+
+from discord.ext import tasks
+
+import notionCache
+from notionScheduler import BACKGROUND
+
+#############
+# CONSTANTS #
+#############
+
+# seconds between syncs while tasks are being edited
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "30"))
+# longest wait between syncs while nothing changes
+MAX_REFRESH_INTERVAL = float(os.getenv("MAX_REFRESH_INTERVAL", "300"))
+
+
+# Description: Sync the snapshot, then double the interval if nothing
+# 			   changed or go back to REFRESH_INTERVAL if something did
+@tasks.loop(seconds=REFRESH_INTERVAL)
+async def refreshLoop():
+    snapshot = notionCache.snapshot
+    try:
+        changed = await snapshot.sync(BACKGROUND)
+    except Exception as e:
+        print("Background refresh failed:", repr(e))
+        return
+
+    if changed == 0:
+        interval = min(refreshLoop.seconds * 2, MAX_REFRESH_INTERVAL)
+    else:
+        interval = REFRESH_INTERVAL
+    if interval != refreshLoop.seconds:
+        refreshLoop.change_interval(seconds=interval)
+
+
+@refreshLoop.before_loop
+async def beforeRefreshLoop():
+    notionCache.snapshot.backgroundSync = True
+
+
+@refreshLoop.after_loop
+async def afterRefreshLoop():
+    notionCache.snapshot.backgroundSync = False
+
+
+# Description: Start the background loop if it is not running yet
+def start():
+    if not refreshLoop.is_running():
+        refreshLoop.start()
@@ -0,0 +1,104 @@
+###
+# notionScheduler.py
+#
+# Description: Token bucket that every request to Notion goes through.
+#              Notion allows an integration roughly 3 requests per second,
+#              so requests wait for a token instead of failing with a 429.
+#              Interactive command traffic is served before background
+#              refreshes.
+###
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+#############
+# CONSTANTS #
+#############
+
+# request priorities, lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# longest delay between two retries of a request in seconds
+MAX_BACKOFF = 30
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Get the number of seconds to wait before retrying a request
+# @param attempt: number of attempts that have already failed
+# @param retryAfter: value of the Retry-After header, if any
+# @return: Retry-After when Notion gave one, otherwise an exponential
+#          backoff with full jitter
+def backoff(attempt, retryAfter=None):
+    if retryAfter is not None:
+        try:
+            return float(retryAfter) + random.uniform(0, 0.5)
+        except ValueError:
+            pass
+    return random.uniform(0, min(MAX_BACKOFF, 0.5 * 2**attempt))
+
+
+class RateLimiter:
+
+    # @param rate: tokens added per second
+    # @param burst: most tokens the bucket can hold
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.pausedUntil = 0
+
+        # heap of (priority, order, future) waiting for a token
+        self.waiters = []
+        self.order = itertools.count()
+        self.dispatcher = None
+
+    # Description: Wait until a token is available for this request
+    # @param priority: INTERACTIVE or BACKGROUND
+    async def acquire(self, priority=INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        await future
+
+    # Description: Stop handing out tokens for a number of seconds.
+    #              Called when Notion answers with a 429
+    def pause(self, seconds):
+        self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+
+    # Description: Add the tokens earned since the last refill
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Description: Hand out tokens to the waiters in priority order until
+    #              nobody is waiting
+    async def dispatch(self):
+        while self.waiters:
+            now = time.monotonic()
+            if now < self.pausedUntil:
+                await asyncio.sleep(self.pausedUntil - now)
+                continue
+
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            priority, order, future = heapq.heappop(self.waiters)
+            # the request was cancelled while waiting
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
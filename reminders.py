@@ -0,0 +1,223 @@
+###
+# reminders.py
+#
+# Description: Remind assignees before their tasks are due. Reminders are
+#              kept in a heap ordered by when they are sent, so the bot
+#              sleeps until the next one instead of scanning every task.
+#              Tasks added or changed in the snapshot are pushed onto the
+#              heap as they arrive, and sent reminders are saved in the task
+#              store so they are not sent again after a restart.
+###
+
+import asyncio
+import datetime as dt
+import heapq
+import os
+import time
+
+import discord
+
+import botHelper
+import notionCache
+import taskModel
+import taskStore
+
+#############
+# CONSTANTS #
+#############
+
+# minutes before the due date to send reminders, seperated by commas
+REMINDER_OFFSETS = [
+    int(minutes) for minutes in os.getenv("REMINDER_OFFSETS",
+                                          "1440,60").split(",")
+    if minutes.strip() != ""
+]
+# channel to post reminders in
+REMINDER_CHANNEL_ID = os.getenv("REMINDER_CHANNEL_ID")
+# DM the members whose display name matches an "Assigned To" tag. Finding
+# members, to DM or mention them, needs the Server Members Intent
+REMINDER_DM = os.getenv("REMINDER_DM", "0") == "1"
+
+####################
+# GLOBAL VARIABLES #
+####################
+
+# (send time, task ID, minutes before, due date) of every reminder. Entries
+# for tasks that were changed or removed are skipped when they are popped
+heap = []
+# (task ID, due date, minutes before) of the reminders already sent
+reminded = set()
+# set when a reminder is pushed in front of the one being waited on
+wakeup = None
+scheduler = None
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Check if reminders are configured
+def enabled():
+    return len(REMINDER_OFFSETS) > 0 and (REMINDER_CHANNEL_ID is not None
+                                          or REMINDER_DM)
+
+
+# Description: Epoch time of a due date. Dates without a time zone are
+# 			   taken as UTC
+def dueTime(due):
+    return taskModel.dueKey(due).replace(tzinfo=dt.timezone.utc).timestamp()
+
+
+# Description: Push the reminders of a task onto the heap. Called by the
+# 			   snapshot for every task that is added or replaced
+def schedule(task):
+    if task.due is None or task.completion:
+        return
+    # entries of changed tasks pile up until they are popped
+    if len(heap) > 2 * len(REMINDER_OFFSETS) * len(
+            notionCache.snapshot.tasksByID) + 1000:
+        rebuild()
+    due = task.due.isoformat()
+    for minutes in REMINDER_OFFSETS:
+        if (task.id, due, minutes) in reminded:
+            continue
+        entry = (dueTime(task.due) - minutes * 60, task.id, minutes, due)
+        heapq.heappush(heap, entry)
+        if heap[0] == entry and wakeup is not None:
+            wakeup.set()
+
+
+# Description: Rebuild the heap from every task in the snapshot
+def rebuild():
+    global heap
+    heap = []
+    for task in list(notionCache.snapshot.tasksByID.values()):
+        schedule(task)
+
+
+# Description: Check that a reminder popped from the heap is still wanted
+# @return: the Task to remind about, or None to skip the reminder
+def currentTask(taskID, minutes, due):
+    task = notionCache.snapshot.tasksByID.get(taskID)
+    if task is None or task.due is None or task.completion:
+        return None
+    if task.due.isoformat() != due or (taskID, due, minutes) in reminded:
+        return None
+    # the bot was offline until after the task was due, or until a later
+    # reminder was also due, which is sent instead
+    now = time.time()
+    if dueTime(task.due) < now:
+        return None
+    for other in REMINDER_OFFSETS:
+        if other < minutes and dueTime(task.due) - other * 60 <= now:
+            return None
+    return task
+
+
+# Description: Format the time left until a task is due
+# @return: i.e. "1 day", "2 hours" or "30 minutes"
+def formatTimeLeft(seconds):
+    minutes = round(seconds / 60)
+    for unit, length in [["day", 1440], ["hour", 60], ["minute", 1]]:
+        if minutes >= length:
+            count = round(minutes / length)
+            return "{0} {1}{2}".format(count, unit, "" if count == 1 else "s")
+    return "less than a minute"
+
+
+# Description: Find the members whose display name matches a tag
+def findMembers(bot, tags, guild=None):
+    guilds = [guild] if guild is not None else bot.guilds
+    members = []
+    for guild in guilds:
+        for tag in tags:
+            member = guild.get_member_named(tag)
+            if member is not None and member not in members:
+                members.append(member)
+    return members
+
+
+# Description: Post a reminder in the reminder channel and DM the assignees
+async def sendReminder(bot, task):
+    timeLeft = formatTimeLeft(dueTime(task.due) - time.time())
+    embed = discord.Embed(title="Reminder: " + task.name + " is due in " +
+                          timeLeft,
+                          description=botHelper.formatTaskInfo(task),
+                          color=botHelper.YELLOW)
+
+    if REMINDER_CHANNEL_ID is not None:
+        channel = bot.get_channel(int(REMINDER_CHANNEL_ID))
+        if channel is None:
+            channel = await bot.fetch_channel(int(REMINDER_CHANNEL_ID))
+        guild = getattr(channel, "guild", None)
+        mentions = [
+            member.mention
+            for member in findMembers(bot, task.assignedTo, guild)
+        ] if guild is not None else []
+        await channel.send(content=" ".join(mentions) or None, embed=embed)
+
+    if REMINDER_DM:
+        for member in findMembers(bot, task.assignedTo):
+            try:
+                await member.send(embed=embed)
+            except discord.HTTPException as e:
+                print("Could not DM reminder to", member, repr(e))
+
+
+#############
+# SCHEDULER #
+#############
+
+
+# Description: Sleep until the next reminder is due and send it
+async def run(bot):
+    await bot.wait_until_ready()
+    while True:
+        wakeup.clear()
+        if len(heap) == 0:
+            await wakeup.wait()
+            continue
+
+        delay = heap[0][0] - time.time()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        sendAt, taskID, minutes, due = heapq.heappop(heap)
+        task = currentTask(taskID, minutes, due)
+        if task is None:
+            continue
+        # saved before sending, a reminder is never sent twice
+        reminded.add((taskID, due, minutes))
+        try:
+            await asyncio.to_thread(taskStore.markReminded, taskID, due,
+                                    minutes)
+            await sendReminder(bot, task)
+        except Exception as e:
+            print("Could not send reminder for", task.name, repr(e))
+
+
+# Description: Start the scheduler on the running event loop if reminders
+# 			   are configured
+async def start(bot):
+    global wakeup, scheduler, reminded
+    if not enabled() or scheduler is not None:
+        return
+    wakeup = asyncio.Event()
+    reminded = await asyncio.to_thread(taskStore.loadReminded)
+    rebuild()
+    notionCache.snapshot.taskListeners.append(schedule)
+    scheduler = asyncio.create_task(run(bot))
+    print("Scheduled {0} reminders".format(len(heap)))
+
+
+# Description: Stop the scheduler
+def stop():
+    global scheduler
+    if scheduler is not None:
+        scheduler.cancel()
+        scheduler = None
+        notionCache.snapshot.taskListeners.remove(schedule)
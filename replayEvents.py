@@ -0,0 +1,56 @@
+###
+# replayEvents.py
+#
+# Description: Replay recorded Notion webhook events against the keep
+#              alive server to test event ingestion locally. Events are
+#              signed with NOTION_WEBHOOK_SECRET when it is set.
+#
+# Usage: python replayEvents.py events.json [url]
+#        events.json holds a list of webhook payloads
+###
+
+import hashlib
+import hmac
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+#############
+# CONSTANTS #
+#############
+
+DEFAULT_URL = "http://localhost:8000/notion/webhook"
+
+
+# Description: POST each event to the webhook endpoint and print the
+# 			   status code returned for it
+def replay(events, url):
+    secret = os.getenv("NOTION_WEBHOOK_SECRET")
+    for event in events:
+        body = json.dumps(event).encode()
+        headers = {"content-type": "application/json"}
+        if secret:
+            headers["X-Notion-Signature"] = "sha256=" + hmac.new(
+                secret.encode(), body, hashlib.sha256).hexdigest()
+        req = urllib.request.Request(url,
+                                     data=body,
+                                     headers=headers,
+                                     method="POST")
+        try:
+            with urllib.request.urlopen(req) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        print(status, event.get("type"), event.get("entity", {}).get("id"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python replayEvents.py events.json [url]")
+        sys.exit(1)
+
+    with open(sys.argv[1]) as f:
+        events = json.load(f)
+    replay(events, sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL)
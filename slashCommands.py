@@ -0,0 +1,321 @@
+###
+# slashCommands.py
+#
+# Description: Slash command versions of the bot's $ commands. Options are
+#              typed and task names and tags are autocompleted from the
+#              snapshot. Every command defers its response first, so slow
+#              Notion writes do not run out Discord's 3 second window, then
+#              runs the $ command with the options joined the same way.
+###
+
+import os
+import time
+
+import discord
+from discord import app_commands
+
+import botHelper
+import botMetrics
+import notionCache
+
+#############
+# CONSTANTS #
+#############
+
+# guild to register the commands in. Guild commands update immediately,
+# global commands (GUILD_ID not set) can take up to an hour
+GUILD_ID = os.getenv("GUILD_ID")
+
+# most choices Discord shows for an autocomplete
+MAX_CHOICES = 25
+# longest name or value of a choice
+MAX_CHOICE_LENGTH = 100
+
+# field choices for /updatetask, matched by bot.fieldValidation
+FIELD_CHOICES = [
+    app_commands.Choice(name=field, value=field)
+    for field in ["name", "description", "date", "assigned to",
+                  "assigned by", "type", "completion"]
+]
+
+
+# Description: Stands in for the command context of a $ command, so the
+# 			   commands can answer an interaction. Messages are sent as
+# 			   followups to the deferred response
+class InteractionContext:
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.author = interaction.user
+        self.guild = interaction.guild
+        self.channel = interaction.channel
+        self.sent = False
+
+    async def send(self, content=None, embed=None, view=None):
+        kwargs = {"wait": True}
+        if content is not None:
+            kwargs["content"] = content
+        if embed is not None:
+            kwargs["embed"] = embed
+        if view is not None:
+            kwargs["view"] = view
+        self.sent = True
+        return await self.interaction.followup.send(**kwargs)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Defer the response, then run a $ command for the interaction
+# @param name: name of the $ command
+# @param args: arguments given to the $ command
+async def runCommand(interaction, name, *args, **kwargs):
+    if not interaction.response.is_done():
+        await interaction.response.defer(thinking=True)
+
+    ctx = InteractionContext(interaction)
+    result = "error"
+    start = time.perf_counter()
+    try:
+        await interaction.client.get_command(name)(ctx, *args, **kwargs)
+        result = "ok"
+    finally:
+        botMetrics.commandLatency.labels("/" + name.lower(), result).observe(
+            time.perf_counter() - start)
+
+    # the deferred response keeps "thinking" until something is sent
+    if not ctx.sent:
+        await interaction.followup.send("Done")
+    # calling the command directly skips the bot's command events
+    interaction.client.dispatch("command_completion", ctx)
+
+
+# Description: Make autocomplete choices from a list of names
+def choices(names):
+    return [
+        app_commands.Choice(name=name[:MAX_CHOICE_LENGTH],
+                            value=name[:MAX_CHOICE_LENGTH])
+        for name in names[:MAX_CHOICES]
+    ]
+
+
+# Description: Complete the last tag of a list of tags seperated by commas
+# @param listNum: [{0: assignTo}, {1: assignBy}, {2: taskType}]
+# @param current: what the user has typed so far
+def tagChoices(listNum, current):
+    typed, comma, last = current.rpartition(",")
+    typed = typed + comma + " " if comma else ""
+    last = last.strip().casefold()
+    tagIndex = notionCache.snapshot.tagIndex[listNum]
+    return choices([
+        typed + tag for key, tag in sorted(tagIndex.items())
+        if key.startswith(last)
+    ])
+
+
+################
+# AUTOCOMPLETE #
+################
+
+
+async def completeTaskName(interaction, current):
+    return choices(notionCache.snapshot.completeNames(current, MAX_CHOICES))
+
+
+async def completeAssignedTo(interaction, current):
+    return tagChoices(0, current)
+
+
+async def completeAssignedBy(interaction, current):
+    return tagChoices(1, current)
+
+
+async def completeTaskType(interaction, current):
+    return tagChoices(2, current)
+
+
+############
+# COMMANDS #
+############
+
+
+@app_commands.command(name="newtask", description="Create a new task")
+@app_commands.describe(name="Unique name of the task",
+                       description="What the task is about",
+                       due="Due date [01 Jan 22 1300]",
+                       assigned_to="Tags seperated by commas",
+                       assigned_by="Tags seperated by commas",
+                       type="Tags seperated by commas")
+@app_commands.autocomplete(assigned_to=completeAssignedTo,
+                           assigned_by=completeAssignedBy,
+                           type=completeTaskType)
+async def newTask(interaction, name: str, description: str, due: str,
+                  assigned_to: str = "", assigned_by: str = "",
+                  type: str = ""):
+    data = "//".join(
+        [name, description, due, assigned_to, assigned_by, type])
+    await runCommand(interaction, "newTask", data)
+
+
+@app_commands.command(name="gettask", description="View a task")
+@app_commands.autocomplete(name=completeTaskName)
+async def getTask(interaction, name: str):
+    await runCommand(interaction, "getTask", name)
+
+
+@app_commands.command(name="updatetask",
+                      description="Update a field of a task")
+@app_commands.describe(info="New value, dates as [01 Jan 22 1300] and "
+                       "tags seperated by commas")
+@app_commands.choices(field=FIELD_CHOICES)
+@app_commands.autocomplete(name=completeTaskName)
+async def updateTask(interaction, name: str, field: str, info: str):
+    await runCommand(interaction, "updateTask",
+                     "//".join([name, field, info]))
+
+
+# Description: Form for /bulkupdatetask. Slash command options cannot hold
+# 			   more than one line, so the updates are typed in a text box
+class BulkUpdateForm(discord.ui.Modal, title="Bulk Update Tasks"):
+    updates = discord.ui.TextInput(
+        label="One update per line: taskName//field//info",
+        style=discord.TextStyle.paragraph,
+        max_length=4000)
+
+    async def on_submit(self, interaction):
+        await runCommand(interaction, "bulkUpdateTask",
+                         data=self.updates.value)
+
+
+@app_commands.command(name="bulkupdatetask",
+                      description="Update many tasks at once")
+async def bulkUpdateTask(interaction):
+    await interaction.response.send_modal(BulkUpdateForm())
+
+
+@app_commands.command(name="deletetask",
+                      description="Mark a task for deletion")
+@app_commands.autocomplete(name=completeTaskName)
+async def deleteTask(interaction, name: str):
+    await runCommand(interaction, "deleteTask", name)
+
+
+@app_commands.command(name="confirmdeletetask",
+                      description="Delete tasks marked for deletion")
+@app_commands.describe(name="Task to delete, leave empty to delete every "
+                       "task you marked")
+@app_commands.autocomplete(name=completeTaskName)
+async def confirmDeleteTask(interaction, name: str = ""):
+    await runCommand(interaction, "confirmDeleteTask", taskNames=name)
+
+
+@app_commands.command(name="listdeletetasks",
+                      description="View the tasks marked for deletion")
+async def listDeleteTasks(interaction):
+    await runCommand(interaction, "listDeleteTasks")
+
+
+@app_commands.command(name="completetask",
+                      description="Mark a task as complete")
+@app_commands.autocomplete(name=completeTaskName)
+async def completeTask(interaction, name: str):
+    await runCommand(interaction, "completeTask", name)
+
+
+@app_commands.command(name="listfields",
+                      description="View the fields of a task")
+async def listFields(interaction):
+    await runCommand(interaction, "listFields")
+
+
+@app_commands.command(name="listtags", description="View the tags")
+async def listTags(interaction):
+    await runCommand(interaction, "listTags")
+
+
+@app_commands.command(name="listtasks",
+                      description="View the tasks assigned to someone")
+@app_commands.autocomplete(assigned_to=completeAssignedTo)
+async def listTasks(interaction, assigned_to: str):
+    await runCommand(interaction, "listTasks", assigned_to)
+
+
+@app_commands.command(name="listmytasks",
+                      description="View the tasks assigned to you")
+async def listMyTasks(interaction):
+    await runCommand(interaction, "listMyTasks")
+
+
+@app_commands.command(name="findtasks",
+                      description="Find tasks that match every filter")
+@app_commands.describe(assigned_to="Tags seperated by commas",
+                       assigned_by="Tags seperated by commas",
+                       type="Tags seperated by commas",
+                       done="Only complete or incomplete tasks",
+                       after="Due on or after [01 Jan 22 1300]",
+                       before="Due on or before [01 Jan 22 1300]",
+                       desc="Text the description contains")
+@app_commands.autocomplete(assigned_to=completeAssignedTo,
+                           assigned_by=completeAssignedBy,
+                           type=completeTaskType)
+async def findTasks(interaction, assigned_to: str = None,
+                    assigned_by: str = None, type: str = None,
+                    done: bool = None, after: str = None,
+                    before: str = None, desc: str = None):
+    filters = [["to", assigned_to], ["by", assigned_by], ["type", type],
+               ["done", None if done is None else "yes" if done else "no"],
+               ["after", after], ["before", before], ["desc", desc]]
+    data = " // ".join(name + ": " + value for name, value in filters
+                       if value is not None)
+    await runCommand(interaction, "findTasks", data=data)
+
+
+@app_commands.command(name="cachestatus",
+                      description="View how fresh the cached tasks are")
+async def cacheStatus(interaction):
+    await runCommand(interaction, "cacheStatus")
+
+
+@app_commands.command(name="listcommands",
+                      description="View all bot commands")
+async def listCommands(interaction):
+    await runCommand(interaction, "listCommands")
+
+
+commands = [
+    newTask, getTask, updateTask, bulkUpdateTask, deleteTask,
+    confirmDeleteTask, listDeleteTasks, completeTask, listFields, listTags,
+    listTasks, listMyTasks, findTasks, cacheStatus, listCommands
+]
+
+
+# Description: Tell the user when a slash command fails, otherwise the
+# 			   deferred response keeps "thinking"
+async def onError(interaction, error):
+    print("Slash command failed:", repr(error))
+    embed = discord.Embed(title="Error!",
+                          description="Something went wrong, report it to "
+                          "the channel *bot-errors*",
+                          color=botHelper.RED)
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=embed)
+    else:
+        await interaction.response.send_message(embed=embed)
+
+
+# Description: Add the slash commands to the bot and register them with
+# 			   Discord. Called from the bot's setup_hook
+async def setup(bot):
+    for command in commands:
+        bot.tree.add_command(command)
+    bot.tree.error(onError)
+
+    if GUILD_ID:
+        guild = discord.Object(id=int(GUILD_ID))
+        bot.tree.copy_global_to(guild=guild)
+        synced = await bot.tree.sync(guild=guild)
+    else:
+        synced = await bot.tree.sync()
+    print("Registered {0} slash commands".format(len(synced)))
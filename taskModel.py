@@ -0,0 +1,88 @@
+###
+# taskModel.py
+#
+# Description: Compact record of a task in the Notion database. Each page
+#              is converted once when it is read from Notion, so the bot
+#              does not keep the full Notion objects or walk their nested
+#              dictionaries on every access.
+###
+
+import datetime as dt
+import sys
+
+
+class Task:
+    __slots__ = ("id", "name", "description", "due", "assignedTo",
+                 "assignedBy", "taskType", "completion", "url", "lastEdited")
+
+    def __init__(self, id, name, description, due, assignedTo, assignedBy,
+                 taskType, completion, url, lastEdited=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.due = due  # datetime, or None if the task has no date
+        self.assignedTo = assignedTo  # tuples of tag names
+        self.assignedBy = assignedBy
+        self.taskType = taskType
+        self.completion = completion
+        self.url = url
+        self.lastEdited = lastEdited  # ISO 8601 last_edited_time
+
+    def __repr__(self):
+        return "Task({0!r}, {1!r})".format(self.id, self.name)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Join the plain text of a rich text or title property.
+# 			   Empty properties give an empty string
+def plainText(items):
+    return "".join(item["plain_text"] for item in items)
+
+
+# Description: Get the names of a multi select property. The names are
+# 			   interned so every task shares one string per tag
+def tagNames(options):
+    return tuple(sys.intern(option["name"]) for option in options)
+
+
+# Description: Parse the start of a Notion date property
+# @return: datetime, or None if the date is empty
+def parseDate(date):
+    if date is None or date.get("start") is None:
+        return None
+    return dt.datetime.fromisoformat(date["start"].replace("Z", "+00:00"))
+
+
+# Description: Convert a Notion page object into a Task
+def taskFromPage(page):
+    properties = page["properties"]
+    return Task(id=page["id"],
+                name=plainText(properties["Task"]["title"]),
+                description=plainText(properties["Description"]["rich_text"]),
+                due=parseDate(properties["Date"]["date"]),
+                assignedTo=tagNames(properties["Assigned to"]["multi_select"]),
+                assignedBy=tagNames(properties["Assigned by"]["multi_select"]),
+                taskType=tagNames(properties["Type"]["multi_select"]),
+                completion=properties["Completion"]["checkbox"],
+                url=page["url"],
+                lastEdited=page.get("last_edited_time"))
+
+
+# Description: Comparable form of a due date. Dates with a time zone are
+# 			   converted to UTC, dates without one are taken as UTC
+def dueKey(due):
+    if due.tzinfo is not None:
+        due = due.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return due
+
+
+# Description: Format the due date the same way users enter it
+# @return: date as [01 Jan 22 1300], or "None" if the task has no date
+def formatDue(task):
+    if task.due is None:
+        return "None"
+    return task.due.strftime("%d %b %y %H%M")
@@ -0,0 +1,339 @@
+###
+# taskStore.py
+#
+# Description: Embedded SQLite store for the tasks and tags of the Notion
+#              database. Tasks are upserted as they change, so the cache
+#              survives restarts. The store is read in full when the bot
+#              starts, lookups use the snapshot's indexes in memory. Every
+#              thread gets its own connection, so large reads and writes
+#              can run off the event loop.
+###
+
+import datetime as dt
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from taskModel import Task
+
+#############
+# CONSTANTS #
+#############
+
+STORE_PATH = os.getenv("TASK_STORE_PATH", "./tasks.db")
+
+# tasks written per transaction, so other writers wait for one batch at
+# most instead of a whole sync
+BATCH_SIZE = 1000
+
+# tag categories, same order as the notionDB.updateTags format
+# [{0: assignTo}, {1: assignBy}, {2: taskType}]
+ASSIGNED_TO = 0
+ASSIGNED_BY = 1
+TASK_TYPE = 2
+
+# columns read by tasksFromRows
+TASK_COLUMNS = "id, name, description, due, completion, url, lastEdited"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    due TEXT,
+    completion INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    lastEdited TEXT
+);
+
+CREATE TABLE IF NOT EXISTS taskTags (
+    taskID TEXT NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+    category INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (taskID, category, position)
+);
+
+CREATE TABLE IF NOT EXISTS tags (
+    category INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (category, position)
+);
+
+CREATE TABLE IF NOT EXISTS reminders (
+    taskID TEXT NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+    due TEXT NOT NULL,
+    minutesBefore INTEGER NOT NULL,
+    PRIMARY KEY (taskID, due, minutesBefore)
+);
+
+CREATE TABLE IF NOT EXISTS pendingDeletions (
+    guildID INTEGER NOT NULL,
+    requesterID INTEGER NOT NULL,
+    taskID TEXT NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+    addedAt REAL NOT NULL,
+    expiresAt REAL NOT NULL,
+    PRIMARY KEY (guildID, requesterID, taskID)
+);
+CREATE INDEX IF NOT EXISTS pendingDeletionsExpiry
+    ON pendingDeletions (expiresAt);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+####################
+# GLOBAL VARIABLES #
+####################
+
+# connection of the current thread, opened on first use
+local = threading.local()
+# every open connection, closed when the bot shuts down
+connections = []
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+
+# Description: Get the current thread's connection to the store, creating
+# 			   the tables on first use. WAL mode lets readers run while a
+# 			   sync writes
+def getConnection():
+    connection = getattr(local, "connection", None)
+    if connection is None or connection not in connections:
+        # connections closed by close() are opened again
+        connection = sqlite3.connect(STORE_PATH, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.executescript(SCHEMA)
+        migrate(connection)
+        local.connection = connection
+        connections.append(connection)
+    return connection
+
+
+# Description: Update a store written by an older version of the bot. The
+# 			   name lookups it indexed are served by the snapshot
+def migrate(connection):
+    with connection:
+        # other threads opening the store wait for the migration
+        connection.execute("BEGIN IMMEDIATE")
+        columns = [
+            row[1] for row in connection.execute("PRAGMA table_info(tasks)")
+        ]
+        if "lowerName" in columns:
+            for index in ["tasksLowerName", "tasksDue", "taskTagsTag"]:
+                connection.execute("DROP INDEX IF EXISTS " + index)
+            connection.execute("ALTER TABLE tasks DROP COLUMN lowerName")
+
+
+# Description: Close every connection. Called when the bot shuts down
+def close():
+    for connection in connections:
+        connection.close()
+    connections.clear()
+
+
+# Description: Build Tasks from rows of the tasks table. The tags of every
+# 			   row are read with one query
+def tasksFromRows(db, rows):
+    tags = {row[0]: [[], [], []] for row in rows}
+    if len(rows) > 500:
+        tagRows = db.execute("SELECT taskID, category, tag FROM taskTags "
+                             "ORDER BY taskID, category, position")
+    else:
+        tagRows = db.execute(
+            "SELECT taskID, category, tag FROM taskTags WHERE taskID IN (" +
+            ", ".join("?" * len(rows)) + ") ORDER BY taskID, category, "
+            "position", list(tags))
+    for taskID, category, tag in tagRows:
+        if taskID in tags:
+            tags[taskID][category].append(sys.intern(tag))
+
+    tasks = []
+    for row in rows:
+        id, name, description, due, completion, url, lastEdited = row
+        tasks.append(
+            Task(id=id,
+                 name=name,
+                 description=description,
+                 due=None if due is None else dt.datetime.fromisoformat(due),
+                 assignedTo=tuple(tags[id][ASSIGNED_TO]),
+                 assignedBy=tuple(tags[id][ASSIGNED_BY]),
+                 taskType=tuple(tags[id][TASK_TYPE]),
+                 completion=bool(completion),
+                 url=url,
+                 lastEdited=lastEdited))
+    return tasks
+
+
+##########
+# WRITES #
+##########
+
+
+# Description: Insert or update tasks, BATCH_SIZE tasks per transaction
+def upsertTasks(tasks):
+    db = getConnection()
+    for start in range(0, len(tasks), BATCH_SIZE):
+        with db:
+            for task in tasks[start:start + BATCH_SIZE]:
+                upsertTask(db, task)
+
+
+# Description: Insert or update a single task and its tags
+def upsertTask(db, task):
+    db.execute(
+        "INSERT INTO tasks (id, name, description, due, completion, url, "
+        "lastEdited) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+        "description = excluded.description, due = excluded.due, "
+        "completion = excluded.completion, url = excluded.url, "
+        "lastEdited = excluded.lastEdited",
+        (task.id, task.name, task.description,
+         None if task.due is None else task.due.isoformat(),
+         int(task.completion), task.url, task.lastEdited))
+    db.execute("DELETE FROM taskTags WHERE taskID = ?", (task.id, ))
+    db.executemany(
+        "INSERT INTO taskTags (taskID, category, position, tag) "
+        "VALUES (?, ?, ?, ?)",
+        [(task.id, category, position, tag)
+         for category, tags in enumerate(
+             [task.assignedTo, task.assignedBy, task.taskType])
+         for position, tag in enumerate(tags)])
+
+
+# Description: Remove a task from the store
+def deleteTask(taskID):
+    db = getConnection()
+    with db:
+        db.execute("DELETE FROM tasks WHERE id = ?", (taskID, ))
+
+
+# Description: Save the tasks changed by a sync. Tasks that are no longer in
+# 			   Notion are removed
+# @param tasks: Tasks that were added or edited
+# @param removedIDs: IDs of the tasks to remove
+def updateTasks(tasks, removedIDs):
+    upsertTasks(tasks)
+    db = getConnection()
+    with db:
+        db.executemany("DELETE FROM tasks WHERE id = ?",
+                       [(taskID, ) for taskID in removedIDs])
+
+
+# Description: Replace the tags with the notionDB.updateTags format
+def saveTags(tags):
+    keys = ["assignToIDs", "assignByIDs", "typeIDs"]
+    db = getConnection()
+    with db:
+        db.execute("DELETE FROM tags")
+        db.executemany(
+            "INSERT INTO tags (category, position, name, id) "
+            "VALUES (?, ?, ?, ?)",
+            [(category, position, tag["name"], tag["id"])
+             for category in range(0, len(keys))
+             for position, tag in enumerate(tags[category][keys[category]])])
+
+
+# Description: Save a value that must survive restarts (i.e. sync cursor)
+def setMeta(key, value):
+    db = getConnection()
+    with db:
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, None if value is None else str(value)))
+
+
+# Description: Record that a reminder was sent, so it is not sent again
+# 			   after a restart. Reminders of deleted tasks are removed with
+# 			   the task
+# @param due: ISO 8601 due date the reminder was for
+def markReminded(taskID, due, minutesBefore):
+    db = getConnection()
+    with db:
+        db.execute(
+            "INSERT OR IGNORE INTO reminders (taskID, due, minutesBefore) "
+            "VALUES (?, ?, ?)", (taskID, due, minutesBefore))
+
+
+# Description: Mark a task for deletion by a user in a guild. Marking it
+# 			   again restarts its expiry
+# @param expiresAt: epoch time after which the mark is dropped
+def addPendingDeletion(guildID, requesterID, taskID, expiresAt):
+    db = getConnection()
+    with db:
+        db.execute(
+            "INSERT INTO pendingDeletions (guildID, requesterID, taskID, "
+            "addedAt, expiresAt) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (guildID, requesterID, taskID) DO UPDATE SET "
+            "expiresAt = excluded.expiresAt",
+            (guildID, requesterID, taskID, time.time(), expiresAt))
+
+
+# Description: Unmark tasks that were deleted or confirmed
+def removePendingDeletions(guildID, requesterID, taskIDs):
+    db = getConnection()
+    with db:
+        db.executemany(
+            "DELETE FROM pendingDeletions WHERE guildID = ? AND "
+            "requesterID = ? AND taskID = ?",
+            [(guildID, requesterID, taskID) for taskID in taskIDs])
+
+
+#########
+# READS #
+#########
+
+
+# Description: Load every task in the store
+def loadTasks():
+    db = getConnection()
+    rows = db.execute("SELECT " + TASK_COLUMNS + " FROM tasks").fetchall()
+    return tasksFromRows(db, rows)
+
+
+# Description: Load the tags in the notionDB.updateTags format
+def loadTags():
+    keys = ["assignToIDs", "assignByIDs", "typeIDs"]
+    tags = [{key: []} for key in keys]
+    for category, name, id in getConnection().execute(
+            "SELECT category, name, id FROM tags ORDER BY category, position"):
+        tags[category][keys[category]].append({"name": name, "id": id})
+    return tags
+
+
+# Description: Load the values saved with setMeta
+# @return: dictionary of key -> value as a string
+def loadMeta():
+    return dict(getConnection().execute("SELECT key, value FROM meta"))
+
+
+# Description: Get the tasks a user marked for deletion in a guild that
+# 			   have not expired. Expired marks are dropped
+# @return: list of task IDs, oldest mark first
+def pendingDeletions(guildID, requesterID):
+    db = getConnection()
+    with db:
+        db.execute("DELETE FROM pendingDeletions WHERE expiresAt <= ?",
+                   (time.time(), ))
+    rows = db.execute(
+        "SELECT taskID FROM pendingDeletions WHERE guildID = ? AND "
+        "requesterID = ? ORDER BY addedAt", (guildID, requesterID))
+    return [row[0] for row in rows]
+
+
+# Description: Load the reminders that were already sent
+# @return: set of (taskID, due, minutesBefore)
+def loadReminded():
+    return set(getConnection().execute(
+        "SELECT taskID, due, minutesBefore FROM reminders"))